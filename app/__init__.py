@@ -0,0 +1,5 @@
+"""
+PixelLock 3DES application package
+"""
+
+from .app import create_app
@@ -3,44 +3,270 @@ PixelLock 3DES - Secure Image Encryption & Decryption System
 Main Flask Application
 """
 
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import (Blueprint, Flask, Response, abort, current_app, render_template,
+                   request, jsonify, send_file)
 from werkzeug.utils import secure_filename
-from crypto_handler import CryptoHandler
-from hash_handler import HashHandler
+from .crypto_handler import CryptoHandler
+from .hash_handler import HashHandler, TreeHasher
+from .catalog_handler import CatalogHandler
+from .retention_handler import RetentionSweeper
+from .storage_handler import LocalStorage, S3Storage, StorageError
+from .job_handler import JobQueue
+from .upload_handler import UploadHandler, StreamUpload, ExpectContinueRequestHandler
+import functools
 import os
 import base64
+import threading
+import uuid
 from pathlib import Path
+from urllib.parse import unquote
 
-# Initialize Flask app
-app = Flask(__name__)
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.dirname(PACKAGE_DIR)
+CONFIG_FILE = os.path.join(PROJECT_DIR, 'config.py')
 
-# Configuration
-UPLOAD_FOLDER = os.path.join(os.path.dirname(__file__), 'uploads')
-ENCRYPTED_FOLDER = os.path.join(os.path.dirname(__file__), 'encrypted_images')
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp', 'tiff'}
-MAX_FILE_SIZE = 50 * 1024 * 1024  # 50MB
+# Default configuration; config.py, the environment and the argument of
+# create_app() override it in that order
+DEFAULT_CONFIG = {
+    'UPLOAD_FOLDER': os.path.join(PACKAGE_DIR, 'uploads'),
+    'ENCRYPTED_FOLDER': os.path.join(PACKAGE_DIR, 'encrypted_images'),
+    'CATALOG_DB': os.path.join(PACKAGE_DIR, 'catalog.db'),
+    'ALLOWED_EXTENSIONS': {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp', 'tiff'},
+    'MAX_FILE_SIZE': 50 * 1024 * 1024,  # 50MB
+    
+    # Retention (None disables a limit)
+    'RETENTION_ENABLED': True,
+    'RETENTION_MAX_AGE': None,  # seconds
+    'RETENTION_MAX_BYTES': None,  # total size of encrypted files
+    'RETENTION_HIGH_WATERMARK': None,  # start deleting at this disk usage, e.g. 0.90
+    'RETENTION_LOW_WATERMARK': 0.80,  # stop deleting at this disk usage
+    'RETENTION_ORPHAN_UPLOAD_AGE': 60 * 60,  # 1 hour
+    'RETENTION_DELETES_PER_SECOND': 20,
+    'RETENTION_INTERVAL': 5 * 60,  # 5 minutes
+    
+    # Storage backend for encrypted files: 'local' (ENCRYPTED_FOLDER) or 's3'
+    'STORAGE_BACKEND': 'local',
+    'S3_ENDPOINT_URL': 'https://s3.amazonaws.com',
+    'S3_BUCKET': 'pixellock',
+    'S3_REGION': 'us-east-1',
+    'S3_ACCESS_KEY': '',
+    'S3_SECRET_KEY': '',
+    'STREAM_CHUNK_SIZE': 1024 * 1024,  # 1MB
+    'FILE_DURABILITY': 'file',  # fsync policy for local writes: 'none', 'file' or 'full'
+    
+    # Background jobs (JOBS_DB=None keeps job records in memory only)
+    'JOB_FOLDER': None,  # default: UPLOAD_FOLDER/jobs
+    'JOBS_DB': None,
+    'JOB_WORKERS': 2,
+    'JOB_RESULT_TTL': 24 * 60 * 60,  # 1 day
+    'JOB_LEASE': 30,  # seconds before a dead process's jobs are taken over
+}
+
+# Settings that can be set from the environment
+ENV_CONFIG = {
+    'STORAGE_BACKEND': 'PIXELLOCK_STORAGE',
+    'S3_ENDPOINT_URL': 'PIXELLOCK_S3_ENDPOINT',
+    'S3_BUCKET': 'PIXELLOCK_S3_BUCKET',
+    'S3_REGION': 'PIXELLOCK_S3_REGION',
+    'S3_ACCESS_KEY': 'PIXELLOCK_S3_ACCESS_KEY',
+    'S3_SECRET_KEY': 'PIXELLOCK_S3_SECRET_KEY',
+    'JOBS_DB': 'PIXELLOCK_JOBS_DB',
+}
+
+# Path settings; relative paths are taken from the project directory
+PATH_CONFIG = ('UPLOAD_FOLDER', 'ENCRYPTED_FOLDER', 'CATALOG_DB', 'JOB_FOLDER', 'JOBS_DB')
+
+# Uploads can carry the key and filename in headers, so they are checked
+# before the body is read (the filename is percent-encoded)
+KEY_HEADER = 'X-Encryption-Key'
+FILENAME_HEADER = 'X-Filename'
+UPLOAD_ENDPOINTS = {'pixellock.encrypt_image', 'pixellock.submit_encrypt_job'}
+
+bp = Blueprint('pixellock', __name__)
+
+
+class AppServices:
+    """
+    Storage, catalog and background workers of one app, created on first use
+    
+    Creating an app opens no files, connections or threads, so it can be
+    done in a pre-fork master whose workers then share it copy-on-write.
+    Services belong to the process that created them: a forked worker
+    that inherits some drops them and creates its own, since threads do
+    not survive a fork and connections must not be shared across one.
+    """
+    
+    def __init__(self, config):
+        self.config = config
+        self._reset()
+    
+    def _reset(self):
+        self._pid = os.getpid()
+        self._lock = threading.RLock()
+        self._instances = {}
+    
+    def _get(self, name, factory):
+        if self._pid != os.getpid():
+            self._reset()
+        with self._lock:
+            if name not in self._instances:
+                self._instances[name] = factory()
+            return self._instances[name]
+    
+    @property
+    def storage(self):
+        """Where encrypted files are stored"""
+        return self._get('storage', self._create_storage)
+    
+    @property
+    def catalog(self):
+        """Metadata catalog of stored encrypted files"""
+        return self._get('catalog', lambda: CatalogHandler(self.config['CATALOG_DB']))
+    
+    @property
+    def retention_sweeper(self):
+        """Garbage collection of old encrypted files and orphaned uploads"""
+        return self._get('retention_sweeper', self._create_retention_sweeper)
+    
+    @property
+    def job_queue(self):
+        """Background queue for large encryptions"""
+        return self._get('job_queue', self._create_job_queue)
+    
+    def _create_storage(self):
+        config = self.config
+        if config['STORAGE_BACKEND'] == 's3':
+            return S3Storage(
+                config['S3_ENDPOINT_URL'],
+                config['S3_BUCKET'],
+                config['S3_ACCESS_KEY'],
+                config['S3_SECRET_KEY'],
+                region=config['S3_REGION']
+            )
+        return LocalStorage(config['ENCRYPTED_FOLDER'], config['FILE_DURABILITY'])
+    
+    def _create_retention_sweeper(self):
+        config = self.config
+        return RetentionSweeper(
+            config['ENCRYPTED_FOLDER'],
+            config['UPLOAD_FOLDER'],
+            catalog=self.catalog,
+            max_age=config['RETENTION_MAX_AGE'],
+            max_total_bytes=config['RETENTION_MAX_BYTES'],
+            high_watermark=config['RETENTION_HIGH_WATERMARK'],
+            low_watermark=config['RETENTION_LOW_WATERMARK'],
+            orphan_upload_age=config['RETENTION_ORPHAN_UPLOAD_AGE'],
+            deletes_per_second=config['RETENTION_DELETES_PER_SECOND'],
+            interval=config['RETENTION_INTERVAL'],
+            job_folder=config['JOB_FOLDER'],
+            job_uploads_in_use=self._job_uploads_in_use
+        )
+    
+    def _job_uploads_in_use(self):
+        """
+        Names of the files in JOB_FOLDER that queued or running jobs still need
+        """
+        return {os.path.basename(job['payload']['upload_path'])
+                for job in self.job_queue.unfinished()}
+    
+    def _create_job_queue(self):
+        config = self.config
+        return JobQueue(
+            {'encrypt': functools.partial(_run_encrypt_job, self)},
+            workers=config['JOB_WORKERS'],
+            db_path=config['JOBS_DB'],
+            result_ttl=config['JOB_RESULT_TTL'],
+            on_abandon=_remove_job_upload,
+            lease=config['JOB_LEASE']
+        )
+    
+    def start(self):
+        """
+        Create the upload folders and start the background workers
+        Runs once per process, on its first request
+        """
+        self._get('started', self._start)
+    
+    def _start(self):
+        config = self.config
+        os.makedirs(config['UPLOAD_FOLDER'], exist_ok=True)
+        os.makedirs(config['JOB_FOLDER'], exist_ok=True)
+        if config['RETENTION_ENABLED']:
+            self.retention_sweeper.start()
+        if config['JOBS_DB']:
+            # Pick up jobs that were queued before a restart
+            self.job_queue.start()
+        return True
+    
+    def close(self):
+        """
+        Stop the background workers and close storage connections
+        """
+        with self._lock:
+            instances, self._instances = self._instances, {}
+        if 'retention_sweeper' in instances:
+            instances['retention_sweeper'].stop()
+        if 'job_queue' in instances:
+            instances['job_queue'].stop(timeout=5)
+        if hasattr(instances.get('storage'), 'close'):
+            instances['storage'].close()
+
+
+def create_app(config=None):
+    """
+    Create the Flask app
+    
+    Args:
+        config: Optional mapping of settings overriding DEFAULT_CONFIG,
+            config.py and the PIXELLOCK_* environment variables
+    
+    Returns:
+        Flask app; its services are created lazily (see AppServices)
+    """
+    app = Flask(__name__)
+    app.config.update(DEFAULT_CONFIG)
+    app.config.from_pyfile(CONFIG_FILE, silent=True)
+    for name, variable in ENV_CONFIG.items():
+        if variable in os.environ:
+            app.config[name] = os.environ[variable]
+    app.config.update(config or {})
+    
+    for name in PATH_CONFIG:
+        if app.config[name]:
+            app.config[name] = os.path.join(PROJECT_DIR, app.config[name])
+    if not app.config['JOB_FOLDER']:
+        app.config['JOB_FOLDER'] = os.path.join(app.config['UPLOAD_FOLDER'], 'jobs')
+    app.config['MAX_CONTENT_LENGTH'] = app.config['MAX_FILE_SIZE']
+    
+    app.extensions['pixellock'] = AppServices(app.config)
+    app.register_blueprint(bp)
+    return app
+
+
+def _services():
+    """Services of the app handling the current request"""
+    return current_app.extensions['pixellock']
 
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-app.config['ENCRYPTED_FOLDER'] = ENCRYPTED_FOLDER
-app.config['MAX_CONTENT_LENGTH'] = MAX_FILE_SIZE
 
-# Create folders if they don't exist
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-os.makedirs(ENCRYPTED_FOLDER, exist_ok=True)
+@bp.before_app_request
+def start_services():
+    """Set up folders and background workers on a process's first request"""
+    _services().start()
 
 
 def allowed_file(filename):
     """Check if file extension is allowed"""
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+    return ('.' in filename
+            and filename.rsplit('.', 1)[1].lower() in current_app.config['ALLOWED_EXTENSIONS'])
 
 
-@app.route('/')
+@bp.route('/')
 def index():
     """Main page"""
     return render_template('index.html')
 
 
-@app.route('/api/generate-key', methods=['POST'])
+@bp.route('/api/generate-key', methods=['POST'])
 def generate_key():
     """Generate a new 3DES key"""
     try:
@@ -57,83 +283,328 @@ def generate_key():
         }), 500
 
 
-@app.route('/api/encrypt', methods=['POST'])
-def encrypt_image():
-    """Encrypt an uploaded image"""
-    try:
+def _header_filename():
+    """Filename sent in the X-Filename header, or '' if there is none"""
+    return unquote(request.headers.get(FILENAME_HEADER, ''))
+
+
+@bp.before_request
+def reject_upload_early():
+    """
+    Reject an upload from its headers alone, before any of its body is read
+    
+    Paired with a server that defers "100 Continue" until the body is read
+    (see ExpectContinueRequestHandler), a client sending
+    "Expect: 100-continue" never uploads a body that would be rejected.
+    """
+    if request.endpoint not in UPLOAD_ENDPOINTS:
+        return None
+    
+    max_size = current_app.config['MAX_FILE_SIZE']
+    if request.content_length is not None and request.content_length > max_size:
+        abort(413)
+    
+    key = request.headers.get(KEY_HEADER)
+    if key is not None:
+        try:
+            CryptoHandler.validate_key(key)
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'message': str(e)
+            }), 400
+    
+    filename = _header_filename()
+    if request.mimetype != 'multipart/form-data' and not (key and filename):
+        return jsonify({
+            'success': False,
+            'message': f'Raw uploads need the {KEY_HEADER} and {FILENAME_HEADER} headers'
+        }), 400
+    
+    if filename and not allowed_file(filename):
+        return jsonify({
+            'success': False,
+            'message': 'File type not allowed. Supported: '
+                       + ', '.join(current_app.config['ALLOWED_EXTENSIONS'])
+        }), 400
+    
+    return None
+
+
+def _get_upload():
+    """
+    Validate the file and key of an encryption request
+    
+    The image is either the 'file' field of a multipart form or the raw
+    request body (named by X-Filename); the key is the 'key' form field or
+    the X-Encryption-Key header. The first bytes of the image are sniffed
+    so that anything but a supported image is rejected before it is saved.
+    Returns (file, key, None), or (None, None, error_response)
+    """
+    if request.mimetype == 'multipart/form-data':
         # Check if file is present
         if 'file' not in request.files:
-            return jsonify({
+            return None, None, (jsonify({
                 'success': False,
                 'message': 'No file provided'
-            }), 400
+            }), 400)
         
         file = request.files['file']
-        key = request.form.get('key')
-        
-        if not key:
-            return jsonify({
-                'success': False,
-                'message': 'No encryption key provided'
-            }), 400
-        
-        if file.filename == '':
-            return jsonify({
-                'success': False,
-                'message': 'No file selected'
-            }), 400
+        key = request.form.get('key') or request.headers.get(KEY_HEADER)
+    else:
+        file = StreamUpload(_header_filename(), b'', request.stream,
+                            current_app.config['STREAM_CHUNK_SIZE'])
+        key = request.headers.get(KEY_HEADER)
+    
+    if not key:
+        return None, None, (jsonify({
+            'success': False,
+            'message': 'No encryption key provided'
+        }), 400)
+    
+    if file.filename == '':
+        return None, None, (jsonify({
+            'success': False,
+            'message': 'No file selected'
+        }), 400)
+    
+    if not allowed_file(file.filename):
+        return None, None, (jsonify({
+            'success': False,
+            'message': 'File type not allowed. Supported: '
+                       + ', '.join(current_app.config['ALLOWED_EXTENSIONS'])
+        }), 400)
+    
+    try:
+        CryptoHandler.validate_key(key)
+    except ValueError as e:
+        return None, None, (jsonify({
+            'success': False,
+            'message': str(e)
+        }), 400)
+    
+    if isinstance(file, StreamUpload):
+        file.head = head = UploadHandler.read_head(file.stream)
+    else:
+        head = UploadHandler.read_head(file.stream)
+        file.stream.seek(0)
+    
+    if UploadHandler.detect_image_type(head) is None:
+        return None, None, (jsonify({
+            'success': False,
+            'message': 'File content is not a supported image'
+        }), 415)
+    
+    return file, key, None
+
+
+@bp.route('/api/encrypt', methods=['POST'])
+def encrypt_image():
+    """Encrypt an uploaded image"""
+    upload_path = None
+    try:
+        file, key, error = _get_upload()
+        if error:
+            return error
         
-        if not allowed_file(file.filename):
-            return jsonify({
-                'success': False,
-                'message': 'File type not allowed. Supported: ' + ', '.join(ALLOWED_EXTENSIONS)
-            }), 400
+        services = _services()
         
         # Save uploaded file
         filename = secure_filename(file.filename)
-        upload_path = os.path.join(UPLOAD_FOLDER, filename)
+        upload_path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
         file.save(upload_path)
         
-        # Generate hash of original image
-        hash_result = HashHandler.generate_hash(upload_path)
+        # Encrypt the image, hashing it in the same read
+        hasher = TreeHasher()
+        with open(upload_path, 'rb') as f:
+            encrypted_data = b''.join(CryptoHandler.iter_encrypt(
+                hasher.reader(f), key, current_app.config['STREAM_CHUNK_SIZE']
+            ))
+        hash_result, tree_result = hasher.results()
         
-        # Encrypt image
-        encrypt_result = CryptoHandler.encrypt_image(upload_path, key)
+        # Generate encrypted filename and store encrypted data
+        encrypted_filename = f"encrypted_{filename}.enc"
+        services.storage.write(encrypted_filename, [encrypted_data])
         
-        if encrypt_result['success']:
-            # Generate encrypted filename
-            encrypted_filename = f"encrypted_{filename}.enc"
-            encrypted_path = os.path.join(ENCRYPTED_FOLDER, encrypted_filename)
-            
-            # Decode and save encrypted data
-            encrypted_data = base64.b64decode(encrypt_result['encrypted_data'])
-            with open(encrypted_path, 'wb') as f:
-                f.write(encrypted_data)
-            
-            # Clean up uploaded file
-            if os.path.exists(upload_path):
-                os.remove(upload_path)
-            
-            return jsonify({
-                'success': True,
-                'encrypted_data': encrypt_result['encrypted_data'],
-                'encrypted_filename': encrypted_filename,
-                'original_hash': hash_result['hash'],
-                'file_size': encrypt_result['file_size'],
-                'encrypted_size': encrypt_result['encrypted_size'],
-                'message': 'Image encrypted successfully'
-            })
-        else:
-            return jsonify(encrypt_result), 400
+        # Record the stored file in the catalog
+        record = services.catalog.add_file(
+            filename=filename,
+            encrypted_filename=encrypted_filename,
+            original_hash=hash_result['hash'],
+            file_size=hasher.file_size,
+            encrypted_size=len(encrypted_data),
+            key_id=CryptoHandler.key_fingerprint(key)
+        )
+        services.catalog.set_tree(record['id'], tree_result)
+        
+        return jsonify({
+            'success': True,
+            'file_id': record['id'],
+            'encrypted_data': base64.b64encode(encrypted_data).decode('utf-8'),
+            'encrypted_filename': encrypted_filename,
+            'original_hash': hash_result['hash'],
+            'tree_root': tree_result['root'],
+            'file_size': hasher.file_size,
+            'encrypted_size': len(encrypted_data),
+            'message': 'Image encrypted successfully'
+        })
     
     except Exception as e:
         return jsonify({
             'success': False,
             'message': f'Encryption error: {str(e)}'
         }), 500
+    
+    finally:
+        # Clean up uploaded file whether or not encryption succeeded
+        if upload_path and os.path.exists(upload_path):
+            os.remove(upload_path)
+
+
+def _remove_job_upload(job):
+    """Delete the uploaded image a job was working from"""
+    upload_path = job['payload']['upload_path']
+    if os.path.exists(upload_path):
+        os.remove(upload_path)
+
+
+def _run_encrypt_job(services, job, secrets, progress):
+    """Encrypt a queued upload straight into storage, reporting progress"""
+    payload = job['payload']
+    upload_path = payload['upload_path']
+    try:
+        hasher = TreeHasher()
+        with open(upload_path, 'rb') as f:
+            encrypted_size = services.storage.write(
+                payload['encrypted_filename'],
+                CryptoHandler.iter_encrypt(hasher.reader(f), secrets['key'],
+                                           services.config['STREAM_CHUNK_SIZE'], progress)
+            )
+        hash_result, tree_result = hasher.results()
+        
+        record = services.catalog.add_file(
+            filename=payload['filename'],
+            encrypted_filename=payload['encrypted_filename'],
+            original_hash=hash_result['hash'],
+            file_size=job['total_bytes'],
+            encrypted_size=encrypted_size,
+            key_id=CryptoHandler.key_fingerprint(secrets['key'])
+        )
+        services.catalog.set_tree(record['id'], tree_result)
+        
+        return {
+            'file_id': record['id'],
+            'encrypted_filename': payload['encrypted_filename'],
+            'original_hash': hash_result['hash'],
+            'tree_root': tree_result['root'],
+            'file_size': job['total_bytes'],
+            'encrypted_size': encrypted_size
+        }
+    finally:
+        _remove_job_upload(job)
+
+
+def _job_status(job):
+    """Public view of a job record"""
+    total = job['total_bytes']
+    return {
+        'success': True,
+        'job_id': job['id'],
+        'state': job['state'],
+        'bytes_processed': job['bytes_processed'],
+        'total_bytes': total,
+        'progress': round(job['bytes_processed'] / total, 4) if total else 0.0,
+        'error': job['error']
+    }
+
+
+@bp.route('/api/jobs/encrypt', methods=['POST'])
+def submit_encrypt_job():
+    """Queue an uploaded image for encryption and return a job id at once"""
+    try:
+        file, key, error = _get_upload()
+        if error:
+            return error
+        
+        filename = secure_filename(file.filename)
+        # Unique upload name so concurrent jobs for the same filename never collide
+        job_folder = current_app.config['JOB_FOLDER']
+        upload_path = os.path.join(job_folder, f'{uuid.uuid4().hex}_{filename}')
+        file.save(upload_path)
+        
+        job_id = _services().job_queue.submit(
+            'encrypt',
+            {
+                'upload_path': upload_path,
+                'filename': filename,
+                'encrypted_filename': f"encrypted_{filename}.enc"
+            },
+            secrets={'key': key},
+            total_bytes=os.path.getsize(upload_path)
+        )
+        
+        return jsonify({
+            'success': True,
+            'job_id': job_id,
+            'status_url': f'/api/jobs/{job_id}',
+            'result_url': f'/api/jobs/{job_id}/result',
+            'message': 'Encryption job queued'
+        }), 202
+    
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'Error queueing job: {str(e)}'
+        }), 500
+
+
+@bp.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Report the state and progress of a job"""
+    job = _services().job_queue.get(job_id)
+    
+    if job is None:
+        return jsonify({
+            'success': False,
+            'message': 'Unknown job id'
+        }), 404
+    
+    return jsonify(_job_status(job))
 
 
-@app.route('/api/decrypt', methods=['POST'])
+@bp.route('/api/jobs/<job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    """Get the result of a finished job"""
+    job = _services().job_queue.get(job_id)
+    
+    if job is None:
+        return jsonify({
+            'success': False,
+            'message': 'Unknown job id'
+        }), 404
+    
+    if job['state'] == JobQueue.FAILED:
+        return jsonify({
+            'success': False,
+            'job_id': job_id,
+            'state': job['state'],
+            'message': f"Encryption failed: {job['error']}"
+        }), 400
+    
+    if job['state'] != JobQueue.COMPLETED:
+        # Not finished yet; poll again
+        return jsonify(_job_status(job)), 202
+    
+    return jsonify({
+        'success': True,
+        'job_id': job_id,
+        'state': job['state'],
+        **job['result'],
+        'message': 'Image encrypted successfully'
+    })
+
+
+@bp.route('/api/decrypt', methods=['POST'])
 def decrypt_image():
     """Decrypt an encrypted image"""
     try:
@@ -179,7 +650,7 @@ def decrypt_image():
         }), 500
 
 
-@app.route('/api/verify-hash', methods=['POST'])
+@bp.route('/api/verify-hash', methods=['POST'])
 def verify_hash():
     """Verify image integrity using hash"""
     try:
@@ -192,14 +663,32 @@ def verify_hash():
             }), 400
         
         image_data = data.get('image_data')
+        digest = data.get('digest')
         provided_hash = data.get('hash')
+        file_id = data.get('file_id')
+        
+        # Compare against the digest stored when the file was encrypted
+        if file_id is not None and not provided_hash:
+            record = _services().catalog.get_file(file_id)
+            if record is None:
+                return jsonify({
+                    'success': False,
+                    'message': 'Unknown file id'
+                }), 404
+            provided_hash = record['original_hash']
         
-        if not image_data or not provided_hash:
+        if not provided_hash or not (image_data or digest):
             return jsonify({
                 'success': False,
                 'message': 'Missing image data or hash'
             }), 400
         
+        # Client already hashed the image locally, so only the digest was sent
+        if digest:
+            verify_result = HashHandler.verify_digest(digest, provided_hash)
+            status = 200 if verify_result['success'] else 400
+            return jsonify(verify_result), status
+        
         # Decode image data
         image_bytes = base64.b64decode(image_data)
         
@@ -215,7 +704,7 @@ def verify_hash():
         }), 500
 
 
-@app.route('/api/generate-hash', methods=['POST'])
+@bp.route('/api/generate-hash', methods=['POST'])
 def generate_hash():
     """Generate hash for image data"""
     try:
@@ -250,7 +739,130 @@ def generate_hash():
         }), 500
 
 
-@app.route('/api/file-info', methods=['POST'])
+def _catalog_query_args():
+    """Read pagination arguments shared by the catalog endpoints"""
+    return {
+        'limit': request.args.get('limit', type=int),
+        'cursor': request.args.get('cursor')
+    }
+
+
+@bp.route('/api/files', methods=['GET'])
+def list_files():
+    """List stored encrypted files, newest first"""
+    try:
+        result = _services().catalog.list_files(**_catalog_query_args())
+        return jsonify(result), 200 if result['success'] else 400
+    
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'Error listing files: {str(e)}'
+        }), 500
+
+
+@bp.route('/api/files/search', methods=['GET'])
+def search_files():
+    """Search stored encrypted files by hash, filename or creation time"""
+    try:
+        result = _services().catalog.search_files(
+            content_hash=request.args.get('hash'),
+            filename=request.args.get('filename'),
+            prefix=request.args.get('prefix', '').lower() in ('1', 'true', 'yes'),
+            since=request.args.get('since', type=float),
+            until=request.args.get('until', type=float),
+            **_catalog_query_args()
+        )
+        return jsonify(result), 200 if result['success'] else 400
+    
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'Error searching files: {str(e)}'
+        }), 500
+
+
+@bp.route('/api/files/<int:file_id>', methods=['GET'])
+def get_file(file_id):
+    """Get the catalog record of a stored encrypted file"""
+    record = _services().catalog.get_file(file_id)
+    
+    if record is None:
+        return jsonify({
+            'success': False,
+            'message': 'Unknown file id'
+        }), 404
+    
+    return jsonify({
+        'success': True,
+        'file': record
+    })
+
+
+@bp.route('/api/files/<int:file_id>/tree', methods=['GET'])
+def get_file_tree(file_id):
+    """Get the stored tree hash (root and leaf hashes) of a file's original image"""
+    tree = _services().catalog.get_tree(file_id)
+    
+    if tree is None:
+        return jsonify({
+            'success': False,
+            'message': 'No tree hash stored for this file'
+        }), 404
+    
+    return jsonify({
+        'success': True,
+        'algorithm': HashHandler.TREE_ALGORITHM,
+        **tree
+    })
+
+
+@bp.route('/api/files/<int:file_id>/content', methods=['GET'])
+def get_file_content(file_id):
+    """Download the stored ciphertext of a file, honoring Range requests"""
+    services = _services()
+    record = services.catalog.get_file(file_id)
+    
+    if record is None:
+        return jsonify({
+            'success': False,
+            'message': 'Unknown file id'
+        }), 404
+    
+    name = record['encrypted_filename']
+    try:
+        total = services.storage.size(name)
+    except StorageError:
+        return jsonify({
+            'success': False,
+            'message': 'Encrypted file is no longer stored'
+        }), 404
+    
+    byte_range = request.range.range_for_length(total) if request.range else None
+    if request.range and byte_range is None and len(request.range.ranges) == 1:
+        # A single range that lies outside the file; multiple ranges are not
+        # supported and get the whole file instead
+        return jsonify({
+            'success': False,
+            'message': 'Requested range not satisfiable'
+        }), 416, {'Content-Range': f'bytes */{total}'}
+    start, stop = byte_range if byte_range else (0, total)
+    
+    response = Response(
+        services.storage.iter_read(name, start, stop - start,
+                                   current_app.config['STREAM_CHUNK_SIZE']),
+        status=206 if byte_range else 200,
+        mimetype='application/octet-stream'
+    )
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.headers['Content-Length'] = str(stop - start)
+    response.headers['Content-Disposition'] = f'attachment; filename="{name}"'
+    if byte_range:
+        response.headers['Content-Range'] = f'bytes {start}-{stop - 1}/{total}'
+    return response
+
+
+@bp.route('/api/file-info', methods=['POST'])
 def get_file_info():
     """Get file information"""
     try:
@@ -290,16 +902,17 @@ def get_file_info():
         }), 500
 
 
-@app.errorhandler(413)
+@bp.app_errorhandler(413)
 def too_large(e):
     """Handle file too large error"""
     return jsonify({
         'success': False,
-        'message': 'File size exceeds maximum allowed size (50MB)'
+        'message': 'File size exceeds maximum allowed size '
+                   f"({current_app.config['MAX_FILE_SIZE'] // (1024 * 1024)}MB)"
     }), 413
 
 
-@app.errorhandler(404)
+@bp.app_errorhandler(404)
 def not_found(e):
     """Handle 404 error"""
     return jsonify({
@@ -308,7 +921,7 @@ def not_found(e):
     }), 404
 
 
-@app.errorhandler(500)
+@bp.app_errorhandler(500)
 def internal_error(e):
     """Handle 500 error"""
     return jsonify({
@@ -318,6 +931,8 @@ def internal_error(e):
 
 
 if __name__ == '__main__':
-    # Run the Flask app
+    # Run the Flask app with: python -m app.app
     # Set debug=False for production
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    app = create_app()
+    app.run(debug=True, host='0.0.0.0', port=5000,
+            request_handler=ExpectContinueRequestHandler)
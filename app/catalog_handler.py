@@ -0,0 +1,323 @@
+"""
+Catalog Handler Module
+Keeps an indexed SQLite record of stored encrypted files
+"""
+
+import base64
+import json
+import sqlite3
+import threading
+import time
+
+
+class CatalogHandler:
+    """
+    Metadata catalog for encrypted files, backed by SQLite in WAL mode
+    
+    Every lookup goes through an index, and listing uses keyset pagination
+    (a cursor on the sort key of the last row) rather than OFFSET, so
+    queries stay O(log n) however many files the catalog holds.
+    """
+    
+    DEFAULT_PAGE_SIZE = 50
+    MAX_PAGE_SIZE = 200
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS files (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            filename TEXT NOT NULL,
+            encrypted_filename TEXT NOT NULL UNIQUE,
+            original_hash TEXT NOT NULL,
+            file_size INTEGER NOT NULL,
+            encrypted_size INTEGER NOT NULL,
+            key_id TEXT,
+            created_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_files_hash ON files (original_hash);
+        CREATE INDEX IF NOT EXISTS idx_files_filename ON files (filename);
+        CREATE INDEX IF NOT EXISTS idx_files_created_at ON files (created_at);
+        CREATE TABLE IF NOT EXISTS file_trees (
+            file_id INTEGER PRIMARY KEY REFERENCES files (id) ON DELETE CASCADE,
+            root TEXT NOT NULL,
+            chunk_size INTEGER NOT NULL,
+            file_size INTEGER NOT NULL,
+            leaves TEXT NOT NULL
+        );
+    """
+    
+    COLUMNS = (
+        'id', 'filename', 'encrypted_filename', 'original_hash',
+        'file_size', 'encrypted_size', 'key_id', 'created_at'
+    )
+    
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._connect().executescript(self.SCHEMA)
+    
+    def _connect(self):
+        """
+        Return this thread's connection, opening it on first use
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA foreign_keys=ON')
+            self._local.conn = conn
+        return conn
+    
+    def _to_record(self, row):
+        return dict(zip(self.COLUMNS, row))
+    
+    def _page_size(self, limit):
+        if limit is None:
+            return self.DEFAULT_PAGE_SIZE
+        return max(1, min(int(limit), self.MAX_PAGE_SIZE))
+    
+    def add_file(self, filename, encrypted_filename, original_hash,
+                 file_size, encrypted_size, key_id=None):
+        """
+        Record a stored encrypted file
+        
+        Re-encrypting under the same name overwrites the file on disk, so
+        the previous record for that encrypted filename is replaced.
+        
+        Returns:
+            The stored record as a dictionary
+        """
+        conn = self._connect()
+        created_at = time.time()
+        with conn:
+            cursor = conn.execute(
+                'INSERT OR REPLACE INTO files (filename, encrypted_filename, '
+                'original_hash, file_size, encrypted_size, key_id, created_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (filename, encrypted_filename, original_hash.lower(),
+                 file_size, encrypted_size, key_id, created_at)
+            )
+        return self.get_file(cursor.lastrowid)
+    
+    def get_file(self, file_id):
+        """
+        Look up a record by id, or None if it does not exist
+        """
+        row = self._connect().execute(
+            f'SELECT {", ".join(self.COLUMNS)} FROM files WHERE id = ?',
+            (file_id,)
+        ).fetchone()
+        return self._to_record(row) if row else None
+    
+    def get_by_encrypted_filename(self, encrypted_filename):
+        """
+        Look up a record by its encrypted filename, or None
+        """
+        row = self._connect().execute(
+            f'SELECT {", ".join(self.COLUMNS)} FROM files WHERE encrypted_filename = ?',
+            (encrypted_filename,)
+        ).fetchone()
+        return self._to_record(row) if row else None
+    
+    def set_tree(self, file_id, tree):
+        """
+        Store the tree hash (from HashHandler.generate_tree_hash) of a file
+        """
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO file_trees (file_id, root, chunk_size, file_size, leaves) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (file_id, tree['root'], tree['chunk_size'], tree['file_size'],
+                 json.dumps(tree['leaves']))
+            )
+    
+    def get_tree(self, file_id):
+        """
+        Look up the stored tree hash of a file, or None
+        """
+        row = self._connect().execute(
+            'SELECT root, chunk_size, file_size, leaves FROM file_trees WHERE file_id = ?',
+            (file_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {
+            'root': row[0],
+            'chunk_size': row[1],
+            'file_size': row[2],
+            'leaves': json.loads(row[3])
+        }
+    
+    def update_key_id(self, encrypted_filename, key_id):
+        """
+        Record that a stored file is now encrypted under a different key
+        
+        Returns:
+            True if a record was updated
+        """
+        conn = self._connect()
+        with conn:
+            cursor = conn.execute(
+                'UPDATE files SET key_id = ? WHERE encrypted_filename = ?',
+                (key_id, encrypted_filename)
+            )
+        return cursor.rowcount > 0
+    
+    def delete_file(self, encrypted_filename):
+        """
+        Remove the record for an encrypted filename
+        
+        Returns:
+            True if a record was removed
+        """
+        conn = self._connect()
+        with conn:
+            cursor = conn.execute(
+                'DELETE FROM files WHERE encrypted_filename = ?',
+                (encrypted_filename,)
+            )
+        return cursor.rowcount > 0
+    
+    @staticmethod
+    def _encode_cursor(*values):
+        return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+    
+    @staticmethod
+    def _decode_cursor(cursor):
+        value, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return value, int(row_id)
+    
+    def _search_query(self, content_hash=None, filename=None, prefix=False,
+                      since=None, until=None, cursor=None):
+        """
+        Build the SQL for one page of a search
+        
+        The sort order follows the filter, so that the index that selects
+        the rows also returns them in order and a page never reads more
+        than it returns: a prefix search is ordered by (filename, id), a
+        time range by (created_at, id) newest first, and everything else
+        by id newest first. The cursor holds the sort key of the last row.
+        
+        Returns:
+            (sql, params, sort_columns)
+        """
+        clauses = []
+        params = []
+        
+        if content_hash:
+            clauses.append('original_hash = ?')
+            params.append(content_hash.lower())
+        
+        if filename and prefix and not content_hash:
+            # Range scan so the filename index is used (LIKE would not be);
+            # a cursor moves the start of the range past the rows already returned
+            order = ('filename', 'id')
+            if cursor:
+                last_name, last_id = self._decode_cursor(cursor)
+                clauses.append('filename >= ? AND (filename, id) > (?, ?)')
+                params.extend([last_name, last_name, last_id])
+            else:
+                clauses.append('filename >= ?')
+                params.append(filename)
+            clauses.append('filename < ?')
+            params.append(filename + '\U0010ffff')
+            if since is not None:
+                clauses.append('created_at >= ?')
+                params.append(float(since))
+            if until is not None:
+                clauses.append('created_at < ?')
+                params.append(float(until))
+            order_by = 'filename, id'
+        
+        elif (since is not None or until is not None) and not content_hash and not filename:
+            order = ('created_at', 'id')
+            if since is not None:
+                clauses.append('created_at >= ?')
+                params.append(float(since))
+            if cursor:
+                last_created, last_id = self._decode_cursor(cursor)
+                clauses.append('created_at <= ? AND (created_at, id) < (?, ?)')
+                params.extend([float(last_created), float(last_created), last_id])
+            elif until is not None:
+                clauses.append('created_at < ?')
+                params.append(float(until))
+            order_by = 'created_at DESC, id DESC'
+        
+        else:
+            order = ('id',)
+            if filename and prefix:
+                clauses.append('filename >= ? AND filename < ?')
+                params.extend([filename, filename + '\U0010ffff'])
+            elif filename:
+                clauses.append('filename = ?')
+                params.append(filename)
+            if since is not None:
+                clauses.append('created_at >= ?')
+                params.append(float(since))
+            if until is not None:
+                clauses.append('created_at < ?')
+                params.append(float(until))
+            if cursor:
+                clauses.append('id < ?')
+                params.append(int(cursor))
+            order_by = 'id DESC'
+        
+        where = f'WHERE {" AND ".join(clauses)}' if clauses else ''
+        sql = f'SELECT {", ".join(self.COLUMNS)} FROM files {where} ORDER BY {order_by} LIMIT ?'
+        return sql, params, order
+    
+    def search_files(self, content_hash=None, filename=None, prefix=False,
+                     since=None, until=None, limit=None, cursor=None):
+        """
+        Search the catalog
+        
+        Results are newest first, except for a filename prefix search
+        (without a hash), which is in filename order.
+        
+        Args:
+            content_hash: Exact SHA-256 of the original image
+            filename: Original filename (exact, or a prefix if prefix=True)
+            since: Only files created at or after this Unix timestamp
+            until: Only files created before this Unix timestamp
+            limit: Page size (capped at MAX_PAGE_SIZE)
+            cursor: next_cursor from the previous page
+        
+        Returns:
+            Dictionary with the matching records and the cursor for the next page
+        """
+        try:
+            page_size = self._page_size(limit)
+            sql, params, order = self._search_query(
+                content_hash, filename, prefix, since, until, cursor
+            )
+            rows = self._connect().execute(sql, params + [page_size + 1]).fetchall()
+            
+            files = [self._to_record(row) for row in rows[:page_size]]
+            next_cursor = None
+            if len(rows) > page_size:
+                last = files[-1]
+                if order == ('id',):
+                    next_cursor = str(last['id'])
+                else:
+                    next_cursor = self._encode_cursor(last[order[0]], last['id'])
+            
+            return {
+                'success': True,
+                'files': files,
+                'count': len(files),
+                'next_cursor': next_cursor,
+                'message': 'Catalog search completed'
+            }
+        
+        except Exception as e:
+            return {
+                'success': False,
+                'message': f'Catalog search failed: {str(e)}'
+            }
+    
+    def list_files(self, limit=None, cursor=None):
+        """
+        List stored files, newest first, one page at a time
+        """
+        return self.search_files(limit=limit, cursor=cursor)
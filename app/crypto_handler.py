@@ -7,7 +7,12 @@ from Crypto.Cipher import DES3
 from Crypto.Random import get_random_bytes
 from Crypto.Util.Padding import pad, unpad
 import base64
+import contextlib
+import hashlib
+import hmac
+import mmap
 import os
+import secrets
 
 
 class CryptoHandler:
@@ -19,6 +24,11 @@ class CryptoHandler:
     KEY_SIZE = 24
     # DES3 block size
     BLOCK_SIZE = DES3.block_size
+    # Read size for streaming operations (a multiple of BLOCK_SIZE)
+    CHUNK_SIZE = 1024 * 1024
+    # fsync policies for file-to-file operations (see _write_mapped)
+    DURABILITY_POLICIES = ('none', 'file', 'full')
+    DEFAULT_DURABILITY = 'file'
     
     def __init__(self):
         pass
@@ -46,6 +56,15 @@ class CryptoHandler:
         except Exception as e:
             raise ValueError(f"Invalid key format: {str(e)}")
     
+    @staticmethod
+    def key_fingerprint(key_str):
+        """
+        Derive a short, non-secret identifier for a key
+        Lets stored files record which key encrypted them without storing the key
+        """
+        key = CryptoHandler.validate_key(key_str)
+        return hashlib.sha256(key).hexdigest()[:16]
+    
     @staticmethod
     def encrypt_image(image_path, key_str, output_path=None):
         """
@@ -149,46 +168,323 @@ class CryptoHandler:
             }
     
     @staticmethod
-    def encrypt_image_file(input_path, output_path, key_str):
+    @contextlib.contextmanager
+    def _map_input(path):
         """
-        Encrypt an image file and save encrypted version
+        Map a file read-only and yield a memoryview of its contents
         """
-        return CryptoHandler.encrypt_image(input_path, key_str, output_path)
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                # mmap cannot map an empty file
+                yield memoryview(b'')
+                return
+            with mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as mapped:
+                view = memoryview(mapped)
+                try:
+                    yield view
+                finally:
+                    view.release()
     
     @staticmethod
-    def decrypt_image_file(input_path, output_path, key_str):
+    def _write_mapped(output_path, size, fill, durability):
         """
-        Decrypt an image file and save decrypted version
+        Atomically create output_path by filling a preallocated mapping
+        
+        The output is built in a temporary file next to output_path and
+        renamed over it only once complete, so a crash never leaves a
+        truncated file behind. fill(view) writes into a writable view of
+        size bytes and returns how many bytes of it are final.
+        
+        Durability policies:
+            'none': rely on the OS to write the data back eventually
+            'file': fsync the file before renaming it into place
+            'full': also fsync the directory so the rename survives power loss
         """
+        if durability not in CryptoHandler.DURABILITY_POLICIES:
+            raise ValueError(f"Durability must be one of {', '.join(CryptoHandler.DURABILITY_POLICIES)}")
+        
+        directory = os.path.dirname(os.path.abspath(output_path))
+        temp_path = os.path.join(
+            directory, f'.{os.path.basename(output_path)}.{secrets.token_hex(8)}.tmp'
+        )
+        # Not mkstemp, whose files are owner-only: the umask sets the mode,
+        # as it does for a file written with open()
+        fd = os.open(temp_path, os.O_RDWR | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0), 0o666)
         try:
-            with open(input_path, 'rb') as f:
-                encrypted_output = f.read()
+            # Reserve the blocks up front so a full disk fails here, not mid-write
+            if hasattr(os, 'posix_fallocate') and size:
+                os.posix_fallocate(fd, 0, size)
+            else:
+                os.ftruncate(fd, size)
+            
+            final_size = 0
+            if size:
+                with mmap.mmap(fd, size) as mapped:
+                    view = memoryview(mapped)
+                    try:
+                        final_size = fill(view)
+                    finally:
+                        view.release()
+                    if durability != 'none':
+                        mapped.flush()
+            
+            if final_size != size:
+                os.ftruncate(fd, final_size)
+            if durability != 'none':
+                os.fsync(fd)
+            os.close(fd)
+            fd = None
+            
+            os.replace(temp_path, output_path)
             
+            if durability == 'full':
+                dir_fd = os.open(directory, os.O_RDONLY)
+                try:
+                    os.fsync(dir_fd)
+                finally:
+                    os.close(dir_fd)
+            return final_size
+        
+        except BaseException:
+            if fd is not None:
+                os.close(fd)
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+    
+    @staticmethod
+    def encrypt_file_mapped(input_path, output_path, key_str, durability=None):
+        """
+        Encrypt a file directly into another file through memory maps
+        
+        The cipher reads from the mapped input and writes into the mapped,
+        preallocated output, so the image is never copied into the heap.
+        The output (IV + ciphertext) is written atomically.
+        
+        Args:
+            input_path: Path to the image file
+            output_path: Path for the encrypted output
+            key_str: Base64-encoded 3DES key
+            durability: 'none', 'file' or 'full' (default: DEFAULT_DURABILITY)
+            
+        Returns:
+            Dictionary with sizes and status
+        """
+        try:
             key = CryptoHandler.validate_key(key_str)
+            block = CryptoHandler.BLOCK_SIZE
+            iv = get_random_bytes(block)
             
-            # Extract IV and encrypted data
-            iv = encrypted_output[:CryptoHandler.BLOCK_SIZE]
-            encrypted_data = encrypted_output[CryptoHandler.BLOCK_SIZE:]
+            with CryptoHandler._map_input(input_path) as data:
+                file_size = len(data)
+                whole = file_size // block * block
+                encrypted_size = block + whole + block
+                
+                def fill(out):
+                    cipher = DES3.new(key, DES3.MODE_CBC, iv)
+                    out[:block] = iv
+                    if whole:
+                        cipher.encrypt(data[:whole], output=out[block:block + whole])
+                    tail = pad(bytes(data[whole:]), block)
+                    cipher.encrypt(tail, output=out[block + whole:])
+                    return encrypted_size
+                
+                CryptoHandler._write_mapped(
+                    output_path, encrypted_size, fill,
+                    durability or CryptoHandler.DEFAULT_DURABILITY
+                )
             
-            # Create cipher
-            cipher = DES3.new(key, DES3.MODE_CBC, iv)
+            return {
+                'success': True,
+                'file_size': file_size,
+                'encrypted_size': encrypted_size,
+                'message': 'Image encrypted successfully'
+            }
+        
+        except Exception as e:
+            return {
+                'success': False,
+                'message': f'Encryption failed: {str(e)}'
+            }
+    
+    @staticmethod
+    def decrypt_file_mapped(input_path, output_path, key_str, durability=None):
+        """
+        Decrypt a file directly into another file through memory maps
+        
+        The ciphertext is decrypted from the mapped input into the mapped,
+        preallocated output, which is then trimmed by the padding length
+        and atomically renamed into place. An existing output_path is left
+        untouched if decryption fails (e.g. wrong key).
+        
+        Args:
+            input_path: Path to the encrypted file (IV + ciphertext)
+            output_path: Path for the decrypted image
+            key_str: Base64-encoded 3DES key
+            durability: 'none', 'file' or 'full' (default: DEFAULT_DURABILITY)
             
-            # Decrypt and unpad
-            decrypted_padded = cipher.decrypt(encrypted_data)
-            decrypted_data = unpad(decrypted_padded, CryptoHandler.BLOCK_SIZE)
+        Returns:
+            Dictionary with size and status
+        """
+        try:
+            key = CryptoHandler.validate_key(key_str)
+            block = CryptoHandler.BLOCK_SIZE
             
-            # Save decrypted file
-            with open(output_path, 'wb') as f:
-                f.write(decrypted_data)
+            with CryptoHandler._map_input(input_path) as data:
+                if len(data) < 2 * block or len(data) % block:
+                    raise ValueError('Encrypted data length is not valid for 3DES')
+                padded_size = len(data) - block
+                
+                def fill(out):
+                    cipher = DES3.new(key, DES3.MODE_CBC, bytes(data[:block]))
+                    cipher.decrypt(data[block:], output=out)
+                    tail = unpad(bytes(out[-block:]), block)
+                    return padded_size - block + len(tail)
+                
+                file_size = CryptoHandler._write_mapped(
+                    output_path, padded_size, fill,
+                    durability or CryptoHandler.DEFAULT_DURABILITY
+                )
             
             return {
                 'success': True,
-                'file_size': len(decrypted_data),
+                'file_size': file_size,
                 'message': 'Image decrypted successfully'
             }
-            
+        
         except Exception as e:
             return {
                 'success': False,
                 'message': f'Decryption failed: {str(e)}'
             }
+    
+    @staticmethod
+    def encrypt_image_file(input_path, output_path, key_str, durability=None):
+        """
+        Encrypt an image file and save encrypted version
+        """
+        return CryptoHandler.encrypt_file_mapped(input_path, output_path, key_str, durability)
+    
+    @staticmethod
+    def decrypt_image_file(input_path, output_path, key_str, durability=None):
+        """
+        Decrypt an image file and save decrypted version
+        """
+        return CryptoHandler.decrypt_file_mapped(input_path, output_path, key_str, durability)
+    
+    @staticmethod
+    def iter_encrypt(reader, key_str, chunk_size=None, progress=None):
+        """
+        Encrypt a binary file object chunk by chunk
+        
+        Produces the same IV + ciphertext layout as encrypt_image, but only
+        one chunk is in memory at a time, so the output can be streamed
+        straight into storage.
+        
+        Args:
+            reader: Binary file object to encrypt
+            key_str: Base64-encoded 3DES key
+            chunk_size: Bytes to read per step
+            progress: Optional callable receiving the total bytes read so far
+            
+        Yields:
+            The IV, then successive chunks of ciphertext
+        """
+        block = CryptoHandler.BLOCK_SIZE
+        chunk_size = max(block, (chunk_size or CryptoHandler.CHUNK_SIZE) // block * block)
+        key = CryptoHandler.validate_key(key_str)
+        
+        iv = get_random_bytes(block)
+        cipher = DES3.new(key, DES3.MODE_CBC, iv)
+        yield iv
+        
+        carry = b''
+        total = 0
+        while True:
+            chunk = reader.read(chunk_size)
+            if not chunk:
+                break
+            total += len(chunk)
+            data = carry + chunk
+            usable = len(data) // block * block
+            carry = data[usable:]
+            if usable:
+                yield cipher.encrypt(data[:usable])
+            if progress is not None:
+                progress(total)
+        
+        yield cipher.encrypt(pad(carry, block))
+    
+    @staticmethod
+    def reencrypt_stream(reader, old_key_str, new_key_str, chunk_size=None, expected_hash=None):
+        """
+        Re-encrypt a stored ciphertext under a new key without ever
+        materializing the plaintext
+        
+        Reads IV + ciphertext from a binary file object in chunks, decrypts
+        with the old key and immediately encrypts with the new key under a
+        fresh IV. Only one chunk of plaintext is in memory at a time.
+        
+        Args:
+            reader: Binary file object positioned at the start of the ciphertext
+            old_key_str: Base64-encoded key the data is currently encrypted with
+            new_key_str: Base64-encoded key to encrypt with
+            chunk_size: Bytes to read per step (rounded down to the block size)
+            expected_hash: Optional hex SHA-256 of the plaintext; the last
+                chunk is only produced if the decrypted data matches it
+        
+        Yields:
+            The new IV, then successive chunks of the new ciphertext
+        
+        Raises:
+            ValueError: If a key is invalid or the ciphertext is malformed
+                (including when it was not encrypted with old_key_str), or
+                the plaintext does not match expected_hash
+        
+        A wrong old key is only caught by the padding check about 255 times
+        in 256, so pass expected_hash whenever the plaintext hash is known.
+        """
+        block = CryptoHandler.BLOCK_SIZE
+        chunk_size = max(block, (chunk_size or CryptoHandler.CHUNK_SIZE) // block * block)
+        old_key = CryptoHandler.validate_key(old_key_str)
+        new_key = CryptoHandler.validate_key(new_key_str)
+        
+        old_iv = reader.read(block)
+        if len(old_iv) != block:
+            raise ValueError('Encrypted data is too short')
+        
+        decipher = DES3.new(old_key, DES3.MODE_CBC, old_iv)
+        digest = hashlib.sha256()
+        new_iv = get_random_bytes(block)
+        cipher = DES3.new(new_key, DES3.MODE_CBC, new_iv)
+        yield new_iv
+        
+        # The last decrypted block is held back until EOF because it carries
+        # the padding that must be stripped before re-padding
+        pending = b''
+        carry = b''
+        while True:
+            chunk = reader.read(chunk_size)
+            if not chunk:
+                break
+            data = carry + chunk
+            usable = len(data) // block * block
+            carry = data[usable:]
+            if not usable:
+                continue
+            
+            plaintext = pending + decipher.decrypt(data[:usable])
+            pending = plaintext[-block:]
+            if len(plaintext) > block:
+                digest.update(plaintext[:-block])
+                yield cipher.encrypt(plaintext[:-block])
+        
+        if carry or not pending:
+            raise ValueError('Encrypted data length is not a multiple of the block size')
+        
+        tail = unpad(pending, block)
+        digest.update(tail)
+        if expected_hash is not None and not hmac.compare_digest(digest.hexdigest(), expected_hash.lower()):
+            raise ValueError('Decrypted data does not match its recorded hash')
+        yield cipher.encrypt(pad(tail, block))
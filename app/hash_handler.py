@@ -4,7 +4,11 @@ Handles hash generation and verification for integrity checking
 """
 
 import hashlib
+import hmac
 import os
+import string
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 
 class HashHandler:
@@ -13,6 +17,39 @@ class HashHandler:
     Ensures integrity of images
     """
     
+    # Leaf size for tree hashes
+    TREE_CHUNK_SIZE = 1024 * 1024
+    TREE_ALGORITHM = 'SHA-256-TREE'
+    # Domain separation so a leaf can never be mistaken for an inner node
+    LEAF_PREFIX = b'\x00'
+    NODE_PREFIX = b'\x01'
+    
+    # Hashing threads shared by every tree hash in the process
+    _executor = None
+    _executor_pid = None
+    _executor_lock = threading.Lock()
+    
+    @staticmethod
+    def executor():
+        """
+        Thread pool shared by all hashing work, created on first use
+        
+        A forked child gets a fresh pool, since the parent's threads are
+        not copied into it.
+        """
+        with HashHandler._executor_lock:
+            if HashHandler._executor is None or HashHandler._executor_pid != os.getpid():
+                HashHandler._executor = ThreadPoolExecutor(thread_name_prefix='hash')
+                HashHandler._executor_pid = os.getpid()
+            return HashHandler._executor
+    
+    @staticmethod
+    def hash_leaf(data):
+        """
+        Hex hash of one tree leaf
+        """
+        return hashlib.sha256(HashHandler.LEAF_PREFIX + data).hexdigest()
+    
     @staticmethod
     def generate_hash(file_path):
         """
@@ -78,18 +115,197 @@ class HashHandler:
             }
     
     @staticmethod
-    def verify_hash(file_path, provided_hash):
+    def _read_chunk(file_path, fd, offset, size):
+        """
+        Read one chunk; uses pread on a shared descriptor where available
+        """
+        if fd is not None:
+            return os.pread(fd, size, offset)
+        with open(file_path, 'rb') as f:
+            f.seek(offset)
+            return f.read(size)
+    
+    @staticmethod
+    def _hash_chunks(file_path, indices, chunk_size, workers=None):
+        """
+        Hash the given chunk indices of a file in parallel
+        hashlib releases the GIL on large buffers, so threads scale across cores.
+        Uses the shared executor unless a number of workers is given.
+        
+        Returns:
+            Dictionary mapping chunk index to hex leaf hash
+        """
+        fd = os.open(file_path, os.O_RDONLY) if hasattr(os, 'pread') else None
+        try:
+            def hash_chunk(index):
+                data = HashHandler._read_chunk(file_path, fd, index * chunk_size, chunk_size)
+                return HashHandler.hash_leaf(data)
+            
+            indices = list(indices)
+            if workers is None:
+                return dict(zip(indices, HashHandler.executor().map(hash_chunk, indices)))
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                return dict(zip(indices, pool.map(hash_chunk, indices)))
+        finally:
+            if fd is not None:
+                os.close(fd)
+    
+    @staticmethod
+    def merkle_root(leaves):
+        """
+        Compute the root of a binary hash tree from hex leaf hashes
+        An unpaired node at the end of a level is carried up unchanged
+        """
+        level = [bytes.fromhex(leaf) for leaf in leaves]
+        if not level:
+            raise ValueError('A hash tree needs at least one leaf')
+        while len(level) > 1:
+            paired = [
+                hashlib.sha256(HashHandler.NODE_PREFIX + level[i] + level[i + 1]).digest()
+                for i in range(0, len(level) - 1, 2)
+            ]
+            if len(level) % 2:
+                paired.append(level[-1])
+            level = paired
+        return level[0].hex()
+    
+    @staticmethod
+    def generate_tree_hash(file_path, chunk_size=None, workers=None):
+        """
+        Generate a tree (Merkle) hash of a file
+        
+        The file is split into fixed-size chunks whose hashes (the leaves)
+        are computed in parallel and combined into a single root. Keeping
+        the leaves allows later verification of individual chunks or byte
+        ranges without rehashing the whole file.
+        
+        Args:
+            file_path: Path to the file
+            chunk_size: Leaf size in bytes (default TREE_CHUNK_SIZE)
+            workers: Number of hashing threads (default: the shared executor)
+            
+        Returns:
+            Dictionary with the root, leaves and tree parameters
+        """
+        try:
+            chunk_size = chunk_size or HashHandler.TREE_CHUNK_SIZE
+            file_size = os.path.getsize(file_path)
+            # An empty file still has one (empty) leaf
+            count = max(1, -(-file_size // chunk_size))
+            
+            hashes = HashHandler._hash_chunks(file_path, range(count), chunk_size, workers)
+            leaves = [hashes[i] for i in range(count)]
+            
+            return {
+                'success': True,
+                'root': HashHandler.merkle_root(leaves),
+                'leaves': leaves,
+                'chunk_size': chunk_size,
+                'file_size': file_size,
+                'algorithm': HashHandler.TREE_ALGORITHM,
+                'message': 'Tree hash generated successfully'
+            }
+            
+        except Exception as e:
+            return {
+                'success': False,
+                'message': f'Tree hash generation failed: {str(e)}'
+            }
+    
+    @staticmethod
+    def verify_tree_hash(file_path, tree, chunks=None, byte_range=None, workers=None):
+        """
+        Verify a file, or part of it, against a stored tree hash
+        
+        Args:
+            file_path: Path to the file
+            tree: Result of generate_tree_hash (root, leaves, chunk_size, file_size)
+            chunks: Optional chunk indices to check
+            byte_range: Optional (start, end) byte range to check, end exclusive
+            workers: Number of hashing threads (default: the shared executor)
+            
+        Returns:
+            Dictionary with the verification result and the corrupted chunks
+            and byte ranges
+        """
+        try:
+            leaves = [leaf.lower() for leaf in tree['leaves']]
+            chunk_size = int(tree['chunk_size'])
+            expected_size = int(tree['file_size'])
+            
+            # Never trust a leaf list that does not produce the stored root
+            if not hmac.compare_digest(HashHandler.merkle_root(leaves), tree['root'].lower()):
+                raise ValueError('Leaf hashes do not match the tree root')
+            
+            if chunks is not None:
+                indices = sorted(set(int(i) for i in chunks))
+            elif byte_range is not None:
+                start, end = (int(v) for v in byte_range)
+                if start < 0 or end <= start:
+                    raise ValueError('Byte range must satisfy 0 <= start < end')
+                indices = list(range(start // chunk_size, -(-end // chunk_size)))
+            else:
+                indices = list(range(len(leaves)))
+            
+            if any(i < 0 or i >= len(leaves) for i in indices):
+                raise ValueError(f'Chunk index out of range (tree has {len(leaves)} chunks)')
+            
+            size_matches = os.path.getsize(file_path) == expected_size
+            hashes = HashHandler._hash_chunks(file_path, indices, chunk_size, workers)
+            corrupted = [i for i in indices if not hmac.compare_digest(hashes[i], leaves[i])]
+            
+            corrupted_ranges = []
+            for i in corrupted:
+                start, end = i * chunk_size, min((i + 1) * chunk_size, expected_size)
+                if corrupted_ranges and corrupted_ranges[-1][1] == start:
+                    corrupted_ranges[-1][1] = end
+                else:
+                    corrupted_ranges.append([start, end])
+            
+            matches = size_matches and not corrupted
+            
+            return {
+                'success': True,
+                'matches': matches,
+                'root': tree['root'],
+                'checked_chunks': len(indices),
+                'corrupted_chunks': corrupted,
+                'corrupted_ranges': corrupted_ranges,
+                'size_matches': size_matches,
+                'message': 'Hash verified successfully' if matches else 'Hash mismatch: File integrity compromised'
+            }
+            
+        except Exception as e:
+            return {
+                'success': False,
+                'message': f'Tree hash verification failed: {str(e)}'
+            }
+    
+    @staticmethod
+    def verify_hash(file_path, provided_hash, tree=None, chunks=None, byte_range=None):
         """
         Verify if a file matches the provided hash
         
+        With a tree (from generate_tree_hash) whose root is provided_hash,
+        only the requested chunks or byte range are rehashed, and the
+        corrupted regions are reported.
+        
         Args:
             file_path: Path to the file
-            provided_hash: Hash to compare against
+            provided_hash: Hash (or tree root) to compare against
+            tree: Optional stored tree hash
+            chunks: Optional chunk indices to check (tree mode)
+            byte_range: Optional (start, end) byte range to check (tree mode)
             
         Returns:
             Dictionary with verification result
         """
         try:
+            if tree is not None:
+                if not hmac.compare_digest(tree['root'].lower(), provided_hash.strip().lower()):
+                    raise ValueError('Provided hash is not the root of the given tree')
+                return HashHandler.verify_tree_hash(file_path, tree, chunks, byte_range)
+            
             result = HashHandler.generate_hash(file_path)
             
             if not result['success']:
@@ -147,6 +363,51 @@ class HashHandler:
                 'message': f'Integrity verification failed: {str(e)}'
             }
     
+    @staticmethod
+    def is_valid_digest(value):
+        """
+        Check that a value looks like a hex-encoded SHA-256 digest
+        """
+        return (
+            isinstance(value, str)
+            and len(value) == 64
+            and all(c in string.hexdigits for c in value)
+        )
+    
+    @staticmethod
+    def verify_digest(calculated_hash, provided_hash):
+        """
+        Verify a digest computed elsewhere (e.g. in the browser) against
+        the provided hash, without needing the original data
+        
+        Args:
+            calculated_hash: Hex SHA-256 digest of the data
+            provided_hash: Hash to compare against
+            
+        Returns:
+            Dictionary with verification result
+        """
+        try:
+            if not HashHandler.is_valid_digest(calculated_hash):
+                raise ValueError('Digest must be 64 hexadecimal characters')
+            
+            calculated_hash = calculated_hash.lower()
+            matches = hmac.compare_digest(calculated_hash, provided_hash.strip().lower())
+            
+            return {
+                'success': True,
+                'matches': matches,
+                'calculated_hash': calculated_hash,
+                'provided_hash': provided_hash,
+                'message': 'Integrity verified successfully' if matches else 'Integrity check failed'
+            }
+            
+        except Exception as e:
+            return {
+                'success': False,
+                'message': f'Integrity verification failed: {str(e)}'
+            }
+    
     @staticmethod
     def generate_multiple_hashes(file_path):
         """
@@ -182,3 +443,83 @@ class HashHandler:
                 'success': False,
                 'message': f'Multi-hash generation failed: {str(e)}'
             }
+
+
+class TreeHasher:
+    """
+    Computes the SHA-256 and the tree hash of data in a single pass
+    
+    Data is fed in order, either with update() or by reading through
+    reader(). Each complete leaf is hashed on the shared executor while the
+    caller carries on, so neither hash needs its own read of the file.
+    """
+    
+    def __init__(self, chunk_size=None):
+        self.chunk_size = chunk_size or HashHandler.TREE_CHUNK_SIZE
+        self.file_size = 0
+        self._sha256 = hashlib.sha256()
+        self._buffer = bytearray()
+        self._leaves = []
+    
+    def update(self, data):
+        self._sha256.update(data)
+        self.file_size += len(data)
+        self._buffer += data
+        while len(self._buffer) >= self.chunk_size:
+            self._submit(bytes(self._buffer[:self.chunk_size]))
+            del self._buffer[:self.chunk_size]
+    
+    def _submit(self, data):
+        self._leaves.append(HashHandler.executor().submit(HashHandler.hash_leaf, data))
+    
+    def reader(self, stream):
+        """
+        Wrap a binary file object so everything read from it is hashed
+        """
+        return _HashingReader(stream, self)
+    
+    def results(self):
+        """
+        Finish hashing
+        
+        Returns:
+            (hash_result, tree_result) in the formats of
+            HashHandler.generate_hash and HashHandler.generate_tree_hash
+        """
+        # An empty input still has one (empty) leaf
+        if self._buffer or not self._leaves:
+            self._submit(bytes(self._buffer))
+            self._buffer = bytearray()
+        leaves = [leaf.result() for leaf in self._leaves]
+        
+        hash_result = {
+            'success': True,
+            'hash': self._sha256.hexdigest(),
+            'algorithm': 'SHA-256',
+            'message': 'Hash generated successfully'
+        }
+        tree_result = {
+            'success': True,
+            'root': HashHandler.merkle_root(leaves),
+            'leaves': leaves,
+            'chunk_size': self.chunk_size,
+            'file_size': self.file_size,
+            'algorithm': HashHandler.TREE_ALGORITHM,
+            'message': 'Tree hash generated successfully'
+        }
+        return hash_result, tree_result
+
+
+class _HashingReader:
+    """
+    Binary file object wrapper that feeds every byte read to a TreeHasher
+    """
+    
+    def __init__(self, stream, hasher):
+        self._stream = stream
+        self._hasher = hasher
+    
+    def read(self, *args):
+        data = self._stream.read(*args)
+        self._hasher.update(data)
+        return data
@@ -0,0 +1,427 @@
+"""
+Job Handler Module
+Background job queue for long-running work such as large encryptions
+"""
+
+import json
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+
+
+class _MemoryJobStore:
+    """
+    Keeps job records in process memory
+    """
+    
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+    
+    def add(self, job):
+        with self._lock:
+            self._jobs[job['id']] = dict(job)
+    
+    def update(self, job_id, **fields):
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id].update(fields)
+    
+    def update_owned(self, job_id, owner, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job['owner'] != owner:
+                return False
+            job.update(fields)
+            return True
+    
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+    
+    def renew(self, owner, lease_until):
+        with self._lock:
+            for job in self._jobs.values():
+                if job['owner'] == owner and job['state'] in JobQueue.UNFINISHED_STATES:
+                    job['lease_until'] = lease_until
+    
+    def expired(self, now):
+        with self._lock:
+            return sorted(
+                (dict(job) for job in self._jobs.values()
+                 if job['state'] in JobQueue.UNFINISHED_STATES and job['lease_until'] < now),
+                key=lambda job: job['created_at']
+            )
+    
+    def unfinished(self):
+        with self._lock:
+            return [dict(job) for job in self._jobs.values()
+                    if job['state'] in JobQueue.UNFINISHED_STATES]
+    
+    def take_over(self, job_id, old_owner, new_owner, lease_until, now):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if (job is None or job['owner'] != old_owner or job['lease_until'] >= now
+                    or job['state'] not in JobQueue.UNFINISHED_STATES):
+                return False
+            job.update(owner=new_owner, lease_until=lease_until)
+            return True
+    
+    def prune(self, before):
+        with self._lock:
+            for job_id in [job_id for job_id, job in self._jobs.items()
+                           if job['state'] in JobQueue.FINISHED_STATES
+                           and job['updated_at'] < before]:
+                del self._jobs[job_id]
+
+
+class _SQLiteJobStore:
+    """
+    Keeps job records in SQLite so they survive a restart and can be
+    shared by several processes
+    """
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            state TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            result TEXT,
+            error TEXT,
+            bytes_processed INTEGER NOT NULL DEFAULT 0,
+            total_bytes INTEGER NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            owner TEXT,
+            lease_until REAL NOT NULL DEFAULT 0
+        );
+    """
+    
+    INDEXES = """
+        CREATE INDEX IF NOT EXISTS idx_jobs_state ON jobs (state, created_at);
+        CREATE INDEX IF NOT EXISTS idx_jobs_updated_at ON jobs (updated_at);
+        CREATE INDEX IF NOT EXISTS idx_jobs_owner ON jobs (owner);
+    """
+    
+    # Columns added after the first release, for upgrading existing databases
+    ADDED_COLUMNS = {
+        'owner': 'TEXT',
+        'lease_until': 'REAL NOT NULL DEFAULT 0'
+    }
+    
+    COLUMNS = (
+        'id', 'kind', 'state', 'payload', 'result', 'error',
+        'bytes_processed', 'total_bytes', 'created_at', 'updated_at',
+        'owner', 'lease_until'
+    )
+    JSON_COLUMNS = ('payload', 'result')
+    
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        conn = self._connect()
+        conn.executescript(self.SCHEMA)
+        existing = {row[1] for row in conn.execute('PRAGMA table_info(jobs)')}
+        for column, definition in self.ADDED_COLUMNS.items():
+            if column not in existing:
+                conn.execute(f'ALTER TABLE jobs ADD COLUMN {column} {definition}')
+        conn.executescript(self.INDEXES)
+    
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+    
+    def _to_job(self, row):
+        job = dict(zip(self.COLUMNS, row))
+        for column in self.JSON_COLUMNS:
+            if job[column] is not None:
+                job[column] = json.loads(job[column])
+        return job
+    
+    def _values(self, fields, columns):
+        return [json.dumps(fields[c]) if c in self.JSON_COLUMNS and fields[c] is not None
+                else fields[c] for c in columns]
+    
+    def _execute(self, sql, params):
+        conn = self._connect()
+        with conn:
+            return conn.execute(sql, params).rowcount
+    
+    def add(self, job):
+        self._execute(
+            f'INSERT INTO jobs ({", ".join(self.COLUMNS)}) '
+            f'VALUES ({", ".join("?" * len(self.COLUMNS))})',
+            self._values(job, self.COLUMNS)
+        )
+    
+    def _update(self, where, where_params, fields):
+        columns = [c for c in fields if c in self.COLUMNS and c != 'id']
+        return self._execute(
+            f'UPDATE jobs SET {", ".join(f"{c} = ?" for c in columns)} WHERE {where}',
+            self._values(fields, columns) + list(where_params)
+        )
+    
+    def update(self, job_id, **fields):
+        self._update('id = ?', [job_id], fields)
+    
+    def update_owned(self, job_id, owner, **fields):
+        return self._update('id = ? AND owner = ?', [job_id, owner], fields) > 0
+    
+    def get(self, job_id):
+        row = self._connect().execute(
+            f'SELECT {", ".join(self.COLUMNS)} FROM jobs WHERE id = ?', (job_id,)
+        ).fetchone()
+        return self._to_job(row) if row else None
+    
+    def renew(self, owner, lease_until):
+        self._execute(
+            'UPDATE jobs SET lease_until = ? WHERE owner = ? AND state IN (?, ?)',
+            (lease_until, owner) + JobQueue.UNFINISHED_STATES
+        )
+    
+    def expired(self, now):
+        rows = self._connect().execute(
+            f'SELECT {", ".join(self.COLUMNS)} FROM jobs '
+            f'WHERE state IN (?, ?) AND lease_until < ? ORDER BY created_at',
+            JobQueue.UNFINISHED_STATES + (now,)
+        ).fetchall()
+        return [self._to_job(row) for row in rows]
+    
+    def unfinished(self):
+        rows = self._connect().execute(
+            f'SELECT {", ".join(self.COLUMNS)} FROM jobs WHERE state IN (?, ?)',
+            JobQueue.UNFINISHED_STATES
+        ).fetchall()
+        return [self._to_job(row) for row in rows]
+    
+    def take_over(self, job_id, old_owner, new_owner, lease_until, now):
+        # Conditional on the old owner and lease, so only one process wins
+        return self._execute(
+            'UPDATE jobs SET owner = ?, lease_until = ? '
+            'WHERE id = ? AND owner IS ? AND lease_until < ? AND state IN (?, ?)',
+            (new_owner, lease_until, job_id, old_owner, now) + JobQueue.UNFINISHED_STATES
+        ) > 0
+    
+    def prune(self, before):
+        self._execute(
+            f'DELETE FROM jobs WHERE state IN ({", ".join("?" * len(JobQueue.FINISHED_STATES))}) '
+            f'AND updated_at < ?',
+            list(JobQueue.FINISHED_STATES) + [before]
+        )
+
+
+class JobQueue:
+    """
+    Runs submitted jobs on a pool of background worker threads
+    
+    Each job kind maps to a handler called as handler(job, secrets, progress),
+    where progress(bytes_processed) reports how far the job has got. The
+    handler's return value becomes the job result; an exception fails the
+    job with its message.
+    
+    Job records live in memory, or in SQLite when db_path is given. The
+    in-memory store is private to one process, so with several worker
+    processes a job can only be polled on the process that accepted it;
+    give them a shared db_path instead.
+    
+    Every job is owned by the queue that accepted it, which renews a lease
+    on its unfinished jobs while it runs. Queues only ever run their own
+    jobs, so processes sharing a database never touch each other's work.
+    A job whose lease ran out (its process died) is taken over by another
+    queue. Secrets (such as encryption keys) are never written to the
+    store: they are kept in memory only, so a taken-over job whose secrets
+    were lost with the old process fails and must be resubmitted.
+    on_abandon(job) is called for such jobs so their inputs can be cleaned
+    up.
+    """
+    
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    COMPLETED = 'completed'
+    FAILED = 'failed'
+    UNFINISHED_STATES = (QUEUED, RUNNING)
+    FINISHED_STATES = (COMPLETED, FAILED)
+    
+    # Persist progress at most this often (seconds) to spare the store
+    PROGRESS_INTERVAL = 0.5
+    
+    def __init__(self, handlers, workers=2, db_path=None, result_ttl=24 * 60 * 60,
+                 on_abandon=None, lease=30):
+        self.handlers = dict(handlers)
+        self.on_abandon = on_abandon
+        self.workers = workers
+        self.result_ttl = result_ttl
+        self.lease = lease
+        self.owner = None
+        self._store = _SQLiteJobStore(db_path) if db_path else _MemoryJobStore()
+        self._queue = queue.Queue()
+        self._secrets = {}
+        self._secrets_lock = threading.Lock()
+        self._threads = []
+        self._stop_event = threading.Event()
+        self._lease_thread = None
+        self._started = False
+        self._start_lock = threading.Lock()
+    
+    def start(self):
+        """
+        Start the worker threads and the lease keeper, which also takes
+        over jobs abandoned by dead queues
+        """
+        with self._start_lock:
+            if self._started:
+                return
+            self._started = True
+            self.owner = uuid.uuid4().hex
+            self._stop_event.clear()
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f'job-worker-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            self._recover()
+            self._lease_thread = threading.Thread(
+                target=self._keep_leases, name='job-leases', daemon=True
+            )
+            self._lease_thread.start()
+    
+    def stop(self, timeout=None):
+        """
+        Stop the workers once they finish their current job
+        """
+        with self._start_lock:
+            self._stop_event.set()
+            if self._lease_thread is not None:
+                self._lease_thread.join(timeout)
+                self._lease_thread = None
+            for _ in self._threads:
+                self._queue.put(None)
+            for thread in self._threads:
+                thread.join(timeout)
+            self._threads = []
+            self._started = False
+    
+    def _keep_leases(self):
+        while not self._stop_event.wait(self.lease / 3):
+            self._store.renew(self.owner, time.time() + self.lease)
+            self._recover()
+    
+    def _recover(self):
+        """
+        Take over unfinished jobs whose owner's lease has run out
+        """
+        now = time.time()
+        for job in self._store.expired(now):
+            if self._store.take_over(job['id'], job['owner'], self.owner,
+                                     now + self.lease, now):
+                self._queue.put(job['id'])
+    
+    def submit(self, kind, payload, secrets=None, total_bytes=0):
+        """
+        Queue a job and return its id immediately
+        """
+        if kind not in self.handlers:
+            raise ValueError(f'Unknown job kind: {kind}')
+        
+        self.start()
+        now = time.time()
+        self._store.prune(now - self.result_ttl)
+        
+        job_id = uuid.uuid4().hex
+        with self._secrets_lock:
+            self._secrets[job_id] = dict(secrets or {})
+        self._store.add({
+            'id': job_id,
+            'kind': kind,
+            'state': self.QUEUED,
+            'payload': payload,
+            'result': None,
+            'error': None,
+            'bytes_processed': 0,
+            'total_bytes': total_bytes,
+            'created_at': now,
+            'updated_at': now,
+            'owner': self.owner,
+            'lease_until': now + self.lease
+        })
+        self._queue.put(job_id)
+        return job_id
+    
+    def get(self, job_id):
+        """
+        Current record of a job, or None if it is unknown
+        """
+        return self._store.get(job_id)
+    
+    def unfinished(self):
+        """
+        Records of all queued and running jobs, including other queues' in a shared store
+        """
+        return self._store.unfinished()
+    
+    def wait(self, job_id, timeout=None):
+        """
+        Block until a job finishes (mainly for scripts and tests)
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            if job is None or job['state'] in self.FINISHED_STATES:
+                return job
+            if deadline is not None and time.monotonic() >= deadline:
+                return job
+            time.sleep(0.01)
+    
+    def _work(self):
+        while True:
+            job_id = self._queue.get()
+            if job_id is None:
+                return
+            try:
+                self._run(job_id)
+            finally:
+                self._queue.task_done()
+    
+    def _run(self, job_id):
+        job = self._store.get(job_id)
+        if job is None or job['state'] in self.FINISHED_STATES or job['owner'] != self.owner:
+            return
+        
+        with self._secrets_lock:
+            secrets = self._secrets.pop(job_id, None)
+        
+        if secrets is None:
+            if self._store.update_owned(
+                job_id, self.owner, state=self.FAILED, updated_at=time.time(),
+                error='Job was interrupted by a restart; please resubmit it'
+            ) and self.on_abandon is not None:
+                self.on_abandon(job)
+            return
+        
+        if not self._store.update_owned(job_id, self.owner, state=self.RUNNING,
+                                        updated_at=time.time()):
+            return
+        last_saved = [0.0]
+        
+        def progress(bytes_processed):
+            now = time.monotonic()
+            if now - last_saved[0] >= self.PROGRESS_INTERVAL:
+                last_saved[0] = now
+                self._store.update(job_id, bytes_processed=bytes_processed, updated_at=time.time())
+        
+        try:
+            result = self.handlers[job['kind']](job, secrets, progress)
+            self._store.update(
+                job_id, state=self.COMPLETED, result=result,
+                bytes_processed=job['total_bytes'], updated_at=time.time()
+            )
+        except Exception as e:
+            self._store.update(job_id, state=self.FAILED, error=str(e), updated_at=time.time())
@@ -0,0 +1,214 @@
+"""
+Retention Handler Module
+Background garbage collection for encrypted images and orphaned uploads
+"""
+
+import os
+import shutil
+import threading
+import time
+
+
+class RetentionSweeper:
+    """
+    Periodically deletes stored files according to a retention policy
+    
+    - Uploads older than orphan_upload_age are removed (they are left behind
+      when a request dies between saving and cleaning up the upload).
+      Background job uploads in job_folder are removed at the same age
+      unless job_uploads_in_use() still lists them, so the uploads of jobs
+      lost in a crash or restart do not pile up.
+    - Encrypted files older than max_age are removed.
+    - If the encrypted files exceed max_total_bytes, the oldest are removed
+      until they fit.
+    - If disk usage reaches high_watermark (off by default), the oldest
+      encrypted files are removed until usage drops to low_watermark. Usage
+      counts everything on the filesystem, so when deleting every encrypted
+      file would still leave usage above high_watermark nothing is deleted.
+    
+    Deletions are rate limited to deletes_per_second so a large sweep never
+    competes with request I/O.
+    """
+    
+    def __init__(self, encrypted_folder, upload_folder, catalog=None,
+                 max_age=None, max_total_bytes=None,
+                 high_watermark=None, low_watermark=0.80,
+                 orphan_upload_age=3600, deletes_per_second=20,
+                 interval=300, extension='.enc', job_folder=None,
+                 job_uploads_in_use=None):
+        if high_watermark is not None and not 0 < low_watermark <= high_watermark <= 1:
+            raise ValueError('Watermarks must satisfy 0 < low <= high <= 1')
+        
+        self.encrypted_folder = encrypted_folder
+        self.upload_folder = upload_folder
+        self.catalog = catalog
+        self.max_age = max_age
+        self.max_total_bytes = max_total_bytes
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.orphan_upload_age = orphan_upload_age
+        self.deletes_per_second = deletes_per_second
+        self.interval = interval
+        self.extension = extension
+        self.job_folder = job_folder
+        self.job_uploads_in_use = job_uploads_in_use
+        
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._last_delete = 0.0
+    
+    def start(self):
+        """
+        Start sweeping in a background daemon thread
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self._run, name='retention-sweeper', daemon=True
+        )
+        self._thread.start()
+    
+    def stop(self, timeout=None):
+        """
+        Stop the background thread
+        """
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+    
+    def _run(self):
+        while not self._stop_event.is_set():
+            self.sweep()
+            self._stop_event.wait(self.interval)
+    
+    def _throttle(self):
+        """
+        Sleep as needed to keep deletions under deletes_per_second
+        """
+        if not self.deletes_per_second:
+            return
+        delay = self._last_delete + 1.0 / self.deletes_per_second - time.monotonic()
+        if delay > 0:
+            self._stop_event.wait(delay)
+        self._last_delete = time.monotonic()
+    
+    @staticmethod
+    def _scan(folder, extension=None):
+        """
+        List (mtime, size, name) for regular files in a folder, oldest first
+        """
+        entries = []
+        try:
+            with os.scandir(folder) as it:
+                for entry in it:
+                    if extension and not entry.name.endswith(extension):
+                        continue
+                    try:
+                        if not entry.is_file(follow_symlinks=False):
+                            continue
+                        stat = entry.stat(follow_symlinks=False)
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.name))
+        except FileNotFoundError:
+            return []
+        entries.sort()
+        return entries
+    
+    def _delete(self, folder, name, in_catalog):
+        """
+        Delete one file (rate limited); returns True if it was removed
+        """
+        self._throttle()
+        try:
+            os.remove(os.path.join(folder, name))
+        except FileNotFoundError:
+            return False
+        if in_catalog and self.catalog is not None:
+            self.catalog.delete_file(name)
+        return True
+    
+    def _bytes_over_watermark(self):
+        """
+        How far disk usage is over the watermarks
+        
+        Returns:
+            (bytes over the high watermark, bytes to free to reach the low
+            watermark), or (0, 0) when below the high watermark or disabled
+        """
+        if self.high_watermark is None:
+            return 0, 0
+        usage = shutil.disk_usage(self.encrypted_folder)
+        if usage.used < usage.total * self.high_watermark:
+            return 0, 0
+        return (usage.used - int(usage.total * self.high_watermark),
+                usage.used - int(usage.total * self.low_watermark))
+    
+    def sweep(self):
+        """
+        Run one retention pass
+        
+        Returns:
+            Dictionary with the number of files deleted and bytes freed
+        """
+        try:
+            now = time.time()
+            orphans_deleted = 0
+            deleted = 0
+            freed = 0
+            
+            if self.orphan_upload_age is not None:
+                for mtime, size, name in self._scan(self.upload_folder):
+                    if mtime > now - self.orphan_upload_age or self._stop_event.is_set():
+                        break
+                    if self._delete(self.upload_folder, name, in_catalog=False):
+                        orphans_deleted += 1
+                
+                if self.job_folder is not None:
+                    in_use = self.job_uploads_in_use() if self.job_uploads_in_use else set()
+                    for mtime, size, name in self._scan(self.job_folder):
+                        if mtime > now - self.orphan_upload_age or self._stop_event.is_set():
+                            break
+                        if name not in in_use and self._delete(self.job_folder, name, in_catalog=False):
+                            orphans_deleted += 1
+            
+            entries = self._scan(self.encrypted_folder, self.extension)
+            remaining_bytes = sum(size for _, size, _ in entries)
+            over_high, bytes_to_free = self._bytes_over_watermark()
+            # Usage is driven by other data if our files cannot bring it
+            # under the high watermark; deleting them would not help
+            watermark_unreachable = over_high > remaining_bytes
+            if watermark_unreachable:
+                bytes_to_free = 0
+            
+            for mtime, size, name in entries:
+                if self._stop_event.is_set():
+                    break
+                expired = self.max_age is not None and mtime <= now - self.max_age
+                over_quota = (self.max_total_bytes is not None
+                              and remaining_bytes > self.max_total_bytes)
+                over_watermark = freed < bytes_to_free
+                # Entries are oldest first, so once nothing applies we are done
+                if not (expired or over_quota or over_watermark):
+                    break
+                if self._delete(self.encrypted_folder, name, in_catalog=True):
+                    deleted += 1
+                    freed += size
+                remaining_bytes -= size
+            
+            return {
+                'success': True,
+                'deleted_files': deleted,
+                'freed_bytes': freed,
+                'orphan_uploads_deleted': orphans_deleted,
+                'watermark_unreachable': watermark_unreachable,
+                'message': 'Retention sweep completed'
+            }
+        
+        except Exception as e:
+            return {
+                'success': False,
+                'message': f'Retention sweep failed: {str(e)}'
+            }
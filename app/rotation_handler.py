@@ -0,0 +1,242 @@
+"""
+Rotation Handler Module
+Bulk re-encryption of stored files when a 3DES key is rotated
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .crypto_handler import CryptoHandler
+
+
+class KeyRotationJob:
+    """
+    Re-encrypts every stored .enc file from an old key to a new key
+    
+    Each file is streamed through CryptoHandler.reencrypt_stream, so the
+    plaintext only ever exists one chunk at a time in memory. Output goes
+    to a temporary file that is fsynced and atomically renamed over the
+    original.
+    
+    The catalog decides which files are rotated. A file is only rewritten
+    if its record names the old key (or no key), and only once its
+    decrypted content matches the recorded hash, since a wrong key passes
+    the padding check 1 time in 256. Files without a record, or under a
+    third key, are skipped and reported. Files already under the new key
+    count as done.
+    
+    Progress is checkpointed so a crashed run resumes where it stopped:
+    
+    - "staged <name>" is written once the temporary file is durable
+    - "done <size>:<mtime_ns> <name>" is written once it has replaced the
+      original, recording the rotated file's size and modification time
+    
+    A file that is staged but not done is finished on resume by renaming
+    the temporary file if it still exists; it is never decrypted twice.
+    The checkpoint is named after both keys and kept after a clean run, so
+    running the same rotation again is a no-op. A file only counts as done
+    while its size and modification time still match the record, so a
+    later rotation back to this key, or a file stored again under the
+    same name, is rotated anew.
+    """
+    
+    TEMP_SUFFIX = '.rotating'
+    
+    def __init__(self, encrypted_folder, old_key, new_key, catalog, checkpoint_path=None,
+                 workers=4, chunk_size=None, extension='.enc'):
+        # Fail fast on bad keys before touching any file
+        self.old_key_id = CryptoHandler.key_fingerprint(old_key)
+        self.new_key_id = CryptoHandler.key_fingerprint(new_key)
+        
+        self.encrypted_folder = encrypted_folder
+        self.old_key = old_key
+        self.new_key = new_key
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.catalog = catalog
+        self.extension = extension
+        self.checkpoint_path = checkpoint_path or os.path.join(
+            encrypted_folder, f'.rotation-{self.old_key_id}-{self.new_key_id}.checkpoint'
+        )
+        
+        self._lock = threading.Lock()
+        self._processed_files = 0
+        self._processed_bytes = 0
+        self._skipped = []
+    
+    def _load_checkpoint(self):
+        """
+        Read the checkpoint into a set of staged filenames and a dictionary
+        mapping done filenames to their recorded fingerprint
+        """
+        staged, done = set(), {}
+        if not os.path.exists(self.checkpoint_path):
+            return staged, done
+        with open(self.checkpoint_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                state, _, name = line.rstrip('\n').partition(' ')
+                if state == 'staged':
+                    staged.add(name)
+                elif state == 'done':
+                    fingerprint, _, name = name.partition(' ')
+                    done[name] = fingerprint
+        return staged, done
+    
+    def _record(self, state, name):
+        """
+        Durably append a state change to the checkpoint
+        """
+        with self._lock:
+            with open(self.checkpoint_path, 'a', encoding='utf-8') as f:
+                f.write(f'{state} {name}\n')
+                f.flush()
+                os.fsync(f.fileno())
+    
+    def _fingerprint(self, name):
+        """
+        Size and modification time of a stored file, or None if it is missing
+        """
+        try:
+            stat = os.stat(os.path.join(self.encrypted_folder, name))
+        except FileNotFoundError:
+            return None
+        return f'{stat.st_size}:{stat.st_mtime_ns}'
+    
+    def _record_done(self, name):
+        self._record('done', f'{self._fingerprint(name)} {name}')
+    
+    def _temp_path(self, name):
+        return os.path.join(self.encrypted_folder, name + self.TEMP_SUFFIX)
+    
+    def _commit(self, name):
+        """
+        Move a staged file into place and mark it done
+        """
+        os.replace(self._temp_path(name), os.path.join(self.encrypted_folder, name))
+        self.catalog.update_key_id(name, self.new_key_id)
+        self._record_done(name)
+    
+    def _skip(self, name, reason):
+        with self._lock:
+            self._skipped.append({'file': name, 'reason': reason})
+        return 0
+    
+    def _rotate_file(self, name):
+        """
+        Re-encrypt one file; returns the number of bytes rewritten
+        """
+        source_path = os.path.join(self.encrypted_folder, name)
+        temp_path = self._temp_path(name)
+        
+        record = self.catalog.get_by_encrypted_filename(name)
+        if record is None:
+            return self._skip(name, 'No catalog record')
+        if record['key_id'] == self.new_key_id:
+            self._record_done(name)
+            return 0
+        if record['key_id'] not in (None, self.old_key_id):
+            return self._skip(name, 'Encrypted with another key')
+        
+        try:
+            with open(source_path, 'rb') as src, open(temp_path, 'wb') as dst:
+                for chunk in CryptoHandler.reencrypt_stream(
+                        src, self.old_key, self.new_key, self.chunk_size,
+                        expected_hash=record['original_hash']):
+                    dst.write(chunk)
+                dst.flush()
+                os.fsync(dst.fileno())
+                size = dst.tell()
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        
+        self._record('staged', name)
+        self._commit(name)
+        
+        with self._lock:
+            self._processed_files += 1
+            self._processed_bytes += size
+        return size
+    
+    def pending_files(self):
+        """
+        List the stored files that still need to be rotated
+        """
+        _, done = self._load_checkpoint()
+        names = sorted(
+            entry.name for entry in os.scandir(self.encrypted_folder)
+            if entry.is_file() and entry.name.endswith(self.extension)
+        )
+        return [name for name in names
+                if name not in done or done[name] != self._fingerprint(name)]
+    
+    def progress(self):
+        """
+        Files and bytes processed so far by the current run
+        """
+        with self._lock:
+            return {
+                'processed_files': self._processed_files,
+                'processed_bytes': self._processed_bytes
+            }
+    
+    def run(self):
+        """
+        Rotate all pending files across a worker pool
+        
+        Returns:
+            Dictionary with counts, failures and throughput
+        """
+        try:
+            started = time.monotonic()
+            staged, done = self._load_checkpoint()
+            
+            # Finish files whose rename was interrupted by a crash
+            resumed = 0
+            for name in sorted(staged - done.keys()):
+                if os.path.exists(self._temp_path(name)):
+                    self._commit(name)
+                else:
+                    # The rename already happened; only the record is missing
+                    self._record_done(name)
+                resumed += 1
+            
+            pending = self.pending_files()
+            failures = []
+            
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                futures = {name: pool.submit(self._rotate_file, name) for name in pending}
+                for name, future in futures.items():
+                    try:
+                        future.result()
+                    except Exception as e:
+                        failures.append({'file': name, 'error': str(e)})
+            
+            elapsed = time.monotonic() - started
+            progress = self.progress()
+            skipped = sorted(self._skipped, key=lambda entry: entry['file'])
+            
+            return {
+                'success': not failures,
+                'rotated_files': progress['processed_files'],
+                'resumed_files': resumed,
+                'failed_files': failures,
+                'skipped_files': skipped,
+                'bytes_processed': progress['processed_bytes'],
+                'elapsed_seconds': round(elapsed, 3),
+                'throughput_mb_s': round(
+                    progress['processed_bytes'] / (1024 * 1024) / elapsed, 2
+                ) if elapsed > 0 else 0.0,
+                'key_id': self.new_key_id,
+                'message': 'Key rotation completed' if not failures
+                           else f'Key rotation finished with {len(failures)} failure(s)'
+            }
+        
+        except Exception as e:
+            return {
+                'success': False,
+                'message': f'Key rotation failed: {str(e)}'
+            }
@@ -219,13 +219,16 @@ elements.encryptBtn.addEventListener('click', async () => {
     showLoadingSpinner(true);
     
     try {
-        const formData = new FormData();
-        formData.append('file', state.currentFile);
-        formData.append('key', key);
-        
+        // Send the image as the raw body with the key and name in headers,
+        // so the server can reject a bad key before the upload starts
         const response = await fetch('/api/encrypt', {
             method: 'POST',
-            body: formData
+            headers: {
+                'Content-Type': state.currentFile.type || 'application/octet-stream',
+                'X-Encryption-Key': key,
+                'X-Filename': encodeURIComponent(state.currentFile.name)
+            },
+            body: state.currentFile
         });
         
         const data = await response.json();
@@ -348,6 +351,40 @@ elements.downloadDecryptedBtn.addEventListener('click', () => {
 // Hash Verification
 // ================================================
 
+function canHashLocally() {
+    return Boolean(window.crypto && window.crypto.subtle);
+}
+
+async function sha256Hex(file) {
+    // Web Crypto has no incremental digest API, so hash the raw buffer in a
+    // single native call instead of building a binary string for btoa
+    const buffer = await file.arrayBuffer();
+    const digest = await window.crypto.subtle.digest('SHA-256', buffer);
+    return Array.from(new Uint8Array(digest))
+        .map(byte => byte.toString(16).padStart(2, '0'))
+        .join('');
+}
+
+function readFileAsBase64(file) {
+    return new Promise((resolve, reject) => {
+        const fileReader = new FileReader();
+        
+        fileReader.onload = (e) => {
+            const byteArray = new Uint8Array(e.target.result);
+            let binaryString = '';
+            
+            for (let i = 0; i < byteArray.byteLength; i++) {
+                binaryString += String.fromCharCode(byteArray[i]);
+            }
+            
+            resolve(btoa(binaryString));
+        };
+        fileReader.onerror = () => reject(fileReader.error);
+        
+        fileReader.readAsArrayBuffer(file);
+    });
+}
+
 elements.verifyBtn.addEventListener('click', async () => {
     const expectedHash = elements.expectedHash.value;
     
@@ -363,68 +400,65 @@ elements.verifyBtn.addEventListener('click', async () => {
     
     showLoadingSpinner(true);
     
+    let payload;
     try {
-        const fileReader = new FileReader();
+        // Send only the digest when the browser can hash the image itself;
+        // fall back to uploading the image (e.g. outside a secure context)
+        if (canHashLocally()) {
+            payload = {
+                digest: await sha256Hex(state.currentFileVerify),
+                hash: expectedHash
+            };
+        } else {
+            payload = {
+                image_data: await readFileAsBase64(state.currentFileVerify),
+                hash: expectedHash
+            };
+        }
+    } catch (error) {
+        showNotification('File reading error: ' + error.message, 'error');
+        showLoadingSpinner(false);
+        return;
+    }
+    
+    try {
+        const response = await fetch('/api/verify-hash', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify(payload)
+        });
         
-        fileReader.onload = async (e) => {
-            const arrayBuffer = e.target.result;
-            const byteArray = new Uint8Array(arrayBuffer);
-            let binaryString = '';
+        const data = await response.json();
+        
+        if (data.success) {
+            const verificationStatus = document.getElementById('verificationStatus');
             
-            for (let i = 0; i < byteArray.byteLength; i++) {
-                binaryString += String.fromCharCode(byteArray[i]);
+            if (data.matches) {
+                verificationStatus.className = 'verification-status success';
+                verificationStatus.innerHTML = '<i class="fas fa-check-circle"></i> Image integrity verified! Hash matches.';
+            } else {
+                verificationStatus.className = 'verification-status failed';
+                verificationStatus.innerHTML = '<i class="fas fa-times-circle"></i> Integrity check failed! Hash does not match.';
             }
             
-            const base64Data = btoa(binaryString);
+            document.getElementById('calculatedHash').textContent = data.calculated_hash;
+            document.getElementById('displayedHash').textContent = data.provided_hash;
+            
+            elements.verifyResults.style.display = 'block';
             
-            try {
-                const response = await fetch('/api/verify-hash', {
-                    method: 'POST',
-                    headers: {
-                        'Content-Type': 'application/json'
-                    },
-                    body: JSON.stringify({
-                        image_data: base64Data,
-                        hash: expectedHash
-                    })
-                });
-                
-                const data = await response.json();
-                
-                if (data.success) {
-                    const verificationStatus = document.getElementById('verificationStatus');
-                    
-                    if (data.matches) {
-                        verificationStatus.className = 'verification-status success';
-                        verificationStatus.innerHTML = '<i class="fas fa-check-circle"></i> Image integrity verified! Hash matches.';
-                    } else {
-                        verificationStatus.className = 'verification-status failed';
-                        verificationStatus.innerHTML = '<i class="fas fa-times-circle"></i> Integrity check failed! Hash does not match.';
-                    }
-                    
-                    document.getElementById('calculatedHash').textContent = data.calculated_hash;
-                    document.getElementById('displayedHash').textContent = data.provided_hash;
-                    
-                    elements.verifyResults.style.display = 'block';
-                    
-                    if (data.matches) {
-                        showNotification('Hash verification successful!', 'success');
-                    } else {
-                        showNotification('Hash verification failed!', 'error');
-                    }
-                } else {
-                    showNotification(data.message, 'error');
-                }
-            } catch (error) {
-                showNotification('Hash verification error: ' + error.message, 'error');
-            } finally {
-                showLoadingSpinner(false);
+            if (data.matches) {
+                showNotification('Hash verification successful!', 'success');
+            } else {
+                showNotification('Hash verification failed!', 'error');
             }
-        };
-        
-        fileReader.readAsArrayBuffer(state.currentFileVerify);
+        } else {
+            showNotification(data.message, 'error');
+        }
     } catch (error) {
-        showNotification('File reading error: ' + error.message, 'error');
+        showNotification('Hash verification error: ' + error.message, 'error');
+    } finally {
         showLoadingSpinner(false);
     }
 });
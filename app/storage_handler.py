@@ -0,0 +1,404 @@
+"""
+Storage Handler Module
+Pluggable storage for encrypted files: local filesystem or S3-compatible object store
+"""
+
+import abc
+import datetime
+import hashlib
+import hmac
+import http.client
+import os
+import queue
+import secrets
+from urllib.parse import quote, urlsplit
+from xml.etree import ElementTree
+
+
+class StorageError(Exception):
+    """
+    Raised when a storage backend cannot complete an operation
+    """
+
+
+class StorageBackend(abc.ABC):
+    """
+    Interface shared by all storage backends
+    
+    Objects are addressed by name (the encrypted filename). Writes take an
+    iterable of byte chunks so ciphertext can be streamed in as it is
+    produced instead of being assembled in memory first.
+    """
+    
+    @abc.abstractmethod
+    def write(self, name, chunks):
+        """
+        Store an object from an iterable of bytes; returns its size
+        """
+        raise NotImplementedError
+    
+    @abc.abstractmethod
+    def read(self, name, offset=0, length=None):
+        """
+        Read an object, or length bytes of it starting at offset
+        """
+        raise NotImplementedError
+    
+    @abc.abstractmethod
+    def size(self, name):
+        """
+        Size of an object in bytes
+        """
+        raise NotImplementedError
+    
+    @abc.abstractmethod
+    def exists(self, name):
+        """
+        Whether an object is stored under name
+        """
+        raise NotImplementedError
+    
+    @abc.abstractmethod
+    def delete(self, name):
+        """
+        Delete an object; returns True if it existed
+        """
+        raise NotImplementedError
+    
+    def iter_read(self, name, offset=0, length=None, chunk_size=1024 * 1024):
+        """
+        Yield an object (or a byte range of it) in chunks using ranged reads
+        """
+        end = self.size(name) if length is None else offset + length
+        while offset < end:
+            chunk = self.read(name, offset, min(chunk_size, end - offset))
+            if not chunk:
+                break
+            offset += len(chunk)
+            yield chunk
+
+
+class LocalStorage(StorageBackend):
+    """
+    Stores objects as files in a local folder
+    
+    Writes go to a temporary file in the same folder and are renamed into
+    place, so readers never see a partially written object.
+    
+    Durability policies:
+        'none': rely on the OS to write the data back eventually
+        'file': fsync the file before renaming it into place
+        'full': also fsync the folder so the rename survives power loss
+    """
+    
+    DURABILITY_POLICIES = ('none', 'file', 'full')
+    
+    def __init__(self, folder, durability='file'):
+        if durability not in self.DURABILITY_POLICIES:
+            raise ValueError(f"Durability must be one of {', '.join(self.DURABILITY_POLICIES)}")
+        self.folder = folder
+        self.durability = durability
+        os.makedirs(folder, exist_ok=True)
+    
+    def _path(self, name):
+        if not name or os.path.basename(name) != name or name in ('.', '..'):
+            raise StorageError(f'Invalid object name: {name!r}')
+        return os.path.join(self.folder, name)
+    
+    def write(self, name, chunks):
+        path = self._path(name)
+        temp_path = os.path.join(self.folder, f'.tmp-{secrets.token_hex(8)}')
+        # The umask sets the mode, as for a file written with open()
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0), 0o666)
+        try:
+            size = 0
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    size += len(chunk)
+                if self.durability != 'none':
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.replace(temp_path, path)
+            if self.durability == 'full':
+                dir_fd = os.open(self.folder, os.O_RDONLY)
+                try:
+                    os.fsync(dir_fd)
+                finally:
+                    os.close(dir_fd)
+            return size
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+    
+    def read(self, name, offset=0, length=None):
+        try:
+            with open(self._path(name), 'rb') as f:
+                f.seek(offset)
+                return f.read() if length is None else f.read(length)
+        except FileNotFoundError:
+            raise StorageError(f'Object not found: {name}')
+    
+    def size(self, name):
+        try:
+            return os.path.getsize(self._path(name))
+        except FileNotFoundError:
+            raise StorageError(f'Object not found: {name}')
+    
+    def exists(self, name):
+        return os.path.isfile(self._path(name))
+    
+    def delete(self, name):
+        try:
+            os.remove(self._path(name))
+            return True
+        except FileNotFoundError:
+            return False
+
+
+class _ConnectionPool:
+    """
+    Thread-safe pool of keep-alive HTTP(S) connections to one host
+    """
+    
+    def __init__(self, scheme, host, port, size, timeout):
+        self._factory = (http.client.HTTPSConnection if scheme == 'https'
+                         else http.client.HTTPConnection)
+        self._host = host
+        self._port = port
+        self._timeout = timeout
+        self._idle = queue.LifoQueue(maxsize=size)
+    
+    def request(self, method, path, headers, body=None):
+        """
+        Send a request and return (status, headers, body)
+        
+        A connection that was closed by the server while idle is retried
+        once on a fresh connection.
+        """
+        for attempt in range(2):
+            try:
+                conn = self._idle.get_nowait()
+                reused = True
+            except queue.Empty:
+                conn = self._factory(self._host, self._port, timeout=self._timeout)
+                reused = False
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+                data = response.read()
+            except (http.client.HTTPException, OSError):
+                conn.close()
+                if reused and attempt == 0:
+                    continue
+                raise
+            if response.will_close:
+                conn.close()
+            else:
+                try:
+                    self._idle.put_nowait(conn)
+                except queue.Full:
+                    conn.close()
+            return response.status, response.headers, data
+    
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class S3Storage(StorageBackend):
+    """
+    Stores objects in an S3-compatible bucket (AWS S3, MinIO, Ceph, ...)
+    
+    Requests are signed with AWS Signature Version 4 and sent over a pool
+    of keep-alive connections. Writes are streamed as a multipart upload
+    of part_size parts, so a large ciphertext is never held in memory in
+    full; objects smaller than one part are sent with a single PUT.
+    """
+    
+    # S3 rejects multipart parts (other than the last) below 5MB
+    MIN_PART_SIZE = 5 * 1024 * 1024
+    
+    def __init__(self, endpoint_url, bucket, access_key, secret_key,
+                 region='us-east-1', prefix='', part_size=8 * 1024 * 1024,
+                 pool_size=10, timeout=60):
+        parts = urlsplit(endpoint_url)
+        if parts.scheme not in ('http', 'https') or not parts.hostname:
+            raise ValueError(f'Invalid S3 endpoint URL: {endpoint_url}')
+        
+        self.bucket = bucket
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        self.prefix = prefix
+        self.part_size = max(part_size, self.MIN_PART_SIZE)
+        self._host_header = parts.netloc
+        self._pool = _ConnectionPool(
+            parts.scheme, parts.hostname, parts.port, pool_size, timeout
+        )
+    
+    def _object_path(self, name):
+        return '/' + quote(f'{self.bucket}/{self.prefix}{name}', safe='/~')
+    
+    def _sign(self, method, path, query, headers, payload_hash):
+        """
+        Add AWS Signature Version 4 headers to a request
+        """
+        now = datetime.datetime.now(datetime.timezone.utc)
+        amz_date = now.strftime('%Y%m%dT%H%M%SZ')
+        date_stamp = now.strftime('%Y%m%d')
+        
+        headers['host'] = self._host_header
+        headers['x-amz-date'] = amz_date
+        headers['x-amz-content-sha256'] = payload_hash
+        
+        signed = sorted(k.lower() for k in headers)
+        canonical_headers = ''.join(
+            f'{k}:{str(headers[k]).strip()}\n' for k in signed
+        )
+        canonical_query = '&'.join(
+            f'{quote(k, safe="~")}={quote(str(v), safe="~")}'
+            for k, v in sorted(query.items())
+        )
+        canonical_request = '\n'.join([
+            method, path, canonical_query, canonical_headers,
+            ';'.join(signed), payload_hash
+        ])
+        
+        scope = f'{date_stamp}/{self.region}/s3/aws4_request'
+        string_to_sign = '\n'.join([
+            'AWS4-HMAC-SHA256', amz_date, scope,
+            hashlib.sha256(canonical_request.encode('utf-8')).hexdigest()
+        ])
+        
+        key = ('AWS4' + self.secret_key).encode('utf-8')
+        for part in (date_stamp, self.region, 's3', 'aws4_request'):
+            key = hmac.new(key, part.encode('utf-8'), hashlib.sha256).digest()
+        signature = hmac.new(key, string_to_sign.encode('utf-8'), hashlib.sha256).hexdigest()
+        
+        headers['authorization'] = (
+            f'AWS4-HMAC-SHA256 Credential={self.access_key}/{scope}, '
+            f'SignedHeaders={";".join(signed)}, Signature={signature}'
+        )
+        return canonical_query
+    
+    def _request(self, method, name, query=None, body=b'', headers=None,
+                 expected=(200,)):
+        query = query or {}
+        headers = {k.lower(): v for k, v in (headers or {}).items()}
+        path = self._object_path(name)
+        payload_hash = hashlib.sha256(body).hexdigest()
+        canonical_query = self._sign(method, path, query, headers, payload_hash)
+        if canonical_query:
+            path = f'{path}?{canonical_query}'
+        
+        status, response_headers, data = self._pool.request(
+            method, path, headers, body or None
+        )
+        if status not in expected:
+            raise StorageError(
+                f'S3 {method} {name} failed with HTTP {status}: '
+                f'{data[:200].decode("utf-8", "replace")}'
+            )
+        return status, response_headers, data
+    
+    @staticmethod
+    def _find_text(xml_data, tag):
+        """
+        Text of the first element with the given local name in an S3 XML reply
+        """
+        for element in ElementTree.fromstring(xml_data).iter():
+            if element.tag.rsplit('}', 1)[-1] == tag:
+                return element.text
+        raise StorageError(f'Missing {tag} in S3 response')
+    
+    def write(self, name, chunks):
+        buffer = bytearray()
+        upload_id = None
+        etags = []
+        size = 0
+        
+        try:
+            for chunk in chunks:
+                buffer += chunk
+                size += len(chunk)
+                while len(buffer) >= self.part_size:
+                    if upload_id is None:
+                        _, _, data = self._request('POST', name, {'uploads': ''})
+                        upload_id = self._find_text(data, 'UploadId')
+                    etags.append(self._upload_part(
+                        name, upload_id, len(etags) + 1, bytes(buffer[:self.part_size])
+                    ))
+                    del buffer[:self.part_size]
+            
+            if upload_id is None:
+                self._request('PUT', name, body=bytes(buffer))
+                return size
+            
+            if buffer:
+                etags.append(self._upload_part(name, upload_id, len(etags) + 1, bytes(buffer)))
+            
+            manifest = ''.join(
+                f'<Part><PartNumber>{number}</PartNumber><ETag>{etag}</ETag></Part>'
+                for number, etag in enumerate(etags, start=1)
+            )
+            body = f'<CompleteMultipartUpload>{manifest}</CompleteMultipartUpload>'.encode('utf-8')
+            _, _, data = self._request('POST', name, {'uploadId': upload_id}, body=body)
+            # S3 can report a failed completion with a 200 status and an error body
+            if b'<Error>' in data:
+                raise StorageError(f'S3 multipart upload of {name} failed: {data[:200]!r}')
+            return size
+        
+        except BaseException:
+            if upload_id is not None:
+                try:
+                    self._request('DELETE', name, {'uploadId': upload_id}, expected=(204, 200, 404))
+                except Exception:
+                    pass
+            raise
+    
+    def _upload_part(self, name, upload_id, part_number, data):
+        _, headers, _ = self._request(
+            'PUT', name, {'partNumber': part_number, 'uploadId': upload_id}, body=data
+        )
+        return headers.get('ETag')
+    
+    def read(self, name, offset=0, length=None):
+        if length == 0:
+            return b''
+        headers = {}
+        if offset or length is not None:
+            end = '' if length is None else offset + length - 1
+            headers['range'] = f'bytes={offset}-{end}'
+        status, _, data = self._request('GET', name, headers=headers,
+                                        expected=(200, 206, 404, 416))
+        if status == 404:
+            raise StorageError(f'Object not found: {name}')
+        if status == 416:
+            return b''
+        return data
+    
+    def size(self, name):
+        status, headers, _ = self._request('HEAD', name, expected=(200, 404))
+        if status == 404:
+            raise StorageError(f'Object not found: {name}')
+        return int(headers.get('Content-Length', 0))
+    
+    def exists(self, name):
+        status, _, _ = self._request('HEAD', name, expected=(200, 404))
+        return status == 200
+    
+    def delete(self, name):
+        existed = self.exists(name)
+        self._request('DELETE', name, expected=(200, 204, 404))
+        return existed
+    
+    def close(self):
+        """
+        Close all pooled connections
+        """
+        self._pool.close()
@@ -0,0 +1,143 @@
+"""
+Upload Handler Module
+Early validation of uploads: content sniffing on the first bytes of a body,
+and a development server handler that defers "100 Continue"
+"""
+
+import shutil
+from werkzeug.serving import WSGIRequestHandler
+
+
+class UploadHandler:
+    """
+    Checks an upload from the first bytes of its body, before it is stored
+    """
+    
+    # Bytes read from the start of a body to identify its format
+    SNIFF_SIZE = 4 * 1024
+    
+    # Leading bytes of each supported image format
+    SIGNATURES = (
+        (b'\x89PNG\r\n\x1a\n', 'png'),
+        (b'\xff\xd8\xff', 'jpeg'),
+        (b'GIF87a', 'gif'),
+        (b'GIF89a', 'gif'),
+        (b'BM', 'bmp'),
+        (b'II*\x00', 'tiff'),
+        (b'MM\x00*', 'tiff'),
+    )
+    
+    @staticmethod
+    def detect_image_type(head):
+        """
+        Identify an image format from the first bytes of a file
+        
+        Args:
+            head: Leading bytes of the file
+        
+        Returns:
+            Format name ('png', 'jpeg', ...) or None if it is not a supported image
+        """
+        if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+            return 'webp'
+        for signature, image_type in UploadHandler.SIGNATURES:
+            if head.startswith(signature):
+                return image_type
+        return None
+    
+    @staticmethod
+    def read_head(stream, size=None):
+        """
+        Read up to size bytes from a stream, which may return short reads
+        """
+        size = size or UploadHandler.SNIFF_SIZE
+        head = b''
+        while len(head) < size:
+            chunk = stream.read(size - len(head))
+            if not chunk:
+                break
+            head += chunk
+        return head
+
+
+class StreamUpload:
+    """
+    An upload sent as the raw request body rather than as a multipart form
+    
+    Offers the filename / save() interface of Werkzeug's FileStorage. The
+    sniffed head has already been consumed from the stream, so save()
+    writes it back in front of the rest of the body.
+    """
+    
+    def __init__(self, filename, head, stream, chunk_size=1024 * 1024):
+        self.filename = filename
+        self.head = head
+        self.stream = stream
+        self.chunk_size = chunk_size
+    
+    def save(self, path):
+        with open(path, 'wb') as f:
+            f.write(self.head)
+            shutil.copyfileobj(self.stream, f, self.chunk_size)
+
+
+class _ContinueOnRead:
+    """
+    Request body wrapper that sends "100 Continue" on the first read
+    """
+    
+    def __init__(self, stream, wfile):
+        self._stream = stream
+        self._wfile = wfile
+        self._continued = False
+    
+    def _continue(self):
+        if not self._continued:
+            self._continued = True
+            self._wfile.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+            self._wfile.flush()
+    
+    def read(self, *args):
+        self._continue()
+        return self._stream.read(*args)
+    
+    def readinto(self, buffer):
+        self._continue()
+        return self._stream.readinto(buffer)
+    
+    def readline(self, *args):
+        self._continue()
+        return self._stream.readline(*args)
+    
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+class ExpectContinueRequestHandler(WSGIRequestHandler):
+    """
+    Werkzeug request handler that answers "Expect: 100-continue" lazily
+    
+    The stock handlers send "100 Continue" before the application runs,
+    so a client always uploads its body even when the request is about to
+    be rejected. Here it is only sent once the application starts reading
+    the body; a request rejected from its headers alone gets its final
+    response straight away and the client never sends the body.
+    """
+    
+    def handle_expect_100(self):
+        # http.server would answer straight after parsing the headers
+        return True
+    
+    def run_wsgi(self):
+        self.expect_continue = self.headers.get('Expect', '').lower().strip() == '100-continue'
+        if self.expect_continue:
+            # Hide the header from the base class, which would answer it eagerly
+            del self.headers['Expect']
+        super().run_wsgi()
+    
+    def make_environ(self):
+        environ = super().make_environ()
+        if self.expect_continue:
+            environ['HTTP_EXPECT'] = '100-continue'
+            environ['wsgi.input'] = _ContinueOnRead(environ['wsgi.input'], self.wfile)
+        return environ
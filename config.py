@@ -1,15 +1,41 @@
 # Configuration file for PixelLock 3DES
+# Read by app.create_app(); relative paths are taken from this directory
 
 # Flask Configuration
-DEBUG = True
+DEBUG = False  # run.py turns debug mode on for the development server
 TESTING = False
 SECRET_KEY = 'your-secret-key-change-in-production'
 
 # Upload Configuration
 UPLOAD_FOLDER = 'app/uploads'
 ENCRYPTED_FOLDER = 'app/encrypted_images'
+CATALOG_DB = 'app/catalog.db'
 MAX_FILE_SIZE = 50 * 1024 * 1024  # 50MB
 
+# Retention Configuration (None disables a limit)
+RETENTION_ENABLED = True
+RETENTION_MAX_AGE = None  # seconds
+RETENTION_MAX_BYTES = None  # total size of encrypted files
+RETENTION_HIGH_WATERMARK = None  # start deleting at this disk usage, e.g. 0.90
+RETENTION_LOW_WATERMARK = 0.80  # stop deleting at this disk usage
+RETENTION_ORPHAN_UPLOAD_AGE = 60 * 60  # 1 hour
+RETENTION_DELETES_PER_SECOND = 20
+RETENTION_INTERVAL = 5 * 60  # 5 minutes
+
+# Storage Configuration ('local' uses ENCRYPTED_FOLDER, 's3' any S3-compatible store)
+STORAGE_BACKEND = 'local'
+S3_ENDPOINT_URL = 'https://s3.amazonaws.com'
+S3_BUCKET = 'pixellock'
+S3_REGION = 'us-east-1'
+STREAM_CHUNK_SIZE = 1024 * 1024  # 1MB
+FILE_DURABILITY = 'file'  # fsync policy for local writes: 'none', 'file' or 'full'
+
+# Background Job Configuration
+JOBS_DB = None  # path to a SQLite file to keep jobs across restarts
+JOB_WORKERS = 2
+JOB_RESULT_TTL = 24 * 60 * 60  # 1 day
+JOB_LEASE = 30  # seconds before a dead process's jobs are taken over
+
 # Allowed Extensions
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp', 'tiff'}
 
@@ -0,0 +1,445 @@
+"""
+PixelLock 3DES - Load Testing Harness
+Drives the API with concurrent requests and reports latency percentiles
+
+Usage:
+    python loadtest.py --concurrency 16 --requests 500 --seed 7
+    python loadtest.py --url http://10.0.0.5:5000 --server-pid 4242
+
+Without --url a server is started locally on a free port and stopped
+afterwards. It keeps its uploads, encrypted files and catalog in a
+temporary directory that is removed when the run ends, and runs without
+the retention sweeper. The request plan (operation and image size of every request)
+is derived from --seed only, so two runs with the same arguments send
+the same traffic and can be compared across serving modes and versions.
+"""
+
+import argparse
+import base64
+import functools
+import hashlib
+import http.client
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from urllib.parse import urlsplit
+
+OPERATIONS = ('encrypt', 'decrypt', 'verify-hash', 'generate-key')
+DEFAULT_MIX = 'encrypt=4,decrypt=3,verify-hash=2,generate-key=1'
+DEFAULT_SIZES = '16KB=6,512KB=3,4MB=1'
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+SIZE_UNITS = {'B': 1, 'KB': 1024, 'MB': 1024 * 1024}
+
+
+def parse_size(text):
+    """Parse a size such as '512KB' or '4MB' into bytes"""
+    text = text.strip().upper()
+    for unit in ('KB', 'MB', 'B'):
+        if text.endswith(unit):
+            return int(float(text[:-len(unit)]) * SIZE_UNITS[unit])
+    return int(text)
+
+
+def parse_weights(text, parse_key=str):
+    """Parse 'a=3,b=1' into a list of (key, weight) pairs"""
+    weights = []
+    for item in text.split(','):
+        key, _, weight = item.partition('=')
+        weight = float(weight) if weight else 1.0
+        if weight < 0:
+            raise ValueError(f'Negative weight in {text!r}')
+        weights.append((parse_key(key.strip()), weight))
+    if not weights or not sum(w for _, w in weights):
+        raise ValueError(f'No positive weights in {text!r}')
+    return weights
+
+
+def build_plan(seed, count, mix, sizes):
+    """Derive the (operation, size) of every request from the seed"""
+    rng = random.Random(seed)
+    operations, operation_weights = zip(*mix)
+    size_values, size_weights = zip(*sizes)
+    return [
+        (rng.choices(operations, operation_weights)[0], rng.choices(size_values, size_weights)[0])
+        for _ in range(count)
+    ]
+
+
+@functools.lru_cache(maxsize=None)
+def make_image(seed, size):
+    """Deterministic image-like payload (PNG signature + pseudo-random bytes)"""
+    rng = random.Random(f'{seed}:{size}')
+    return PNG_SIGNATURE + rng.randbytes(max(0, size - len(PNG_SIGNATURE)))
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * p // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def multipart_body(fields, file_field, filename, content):
+    """Encode a multipart/form-data body; returns (content_type, body)"""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+        )
+    parts.append(
+        f'--{boundary}\r\nContent-Disposition: form-data; name="{file_field}"; '
+        f'filename="{filename}"\r\nContent-Type: application/octet-stream\r\n\r\n'.encode()
+    )
+    parts.append(content)
+    parts.append(f'\r\n--{boundary}--\r\n'.encode())
+    return f'multipart/form-data; boundary={boundary}', b''.join(parts)
+
+
+class Client:
+    """One keep-alive HTTP connection per worker thread"""
+    
+    def __init__(self, base_url, timeout):
+        parts = urlsplit(base_url)
+        factory = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self._connect = lambda: factory(parts.hostname, parts.port, timeout=timeout)
+        self._conn = None
+    
+    def request(self, method, path, body=None, headers=None):
+        """
+        Send a request and return (status, body)
+        
+        A request is only sent again when a kept-alive connection turns out
+        to have been closed by the server before any of the response
+        arrived. Any other failure (a timeout, a reset on a new connection,
+        an error mid-response) is raised, so it is counted once as an error
+        instead of doubling the load and the measured latency.
+        """
+        while True:
+            reused = self._conn is not None
+            if not reused:
+                self._conn = self._connect()
+            try:
+                self._conn.request(method, path, body=body, headers=headers or {})
+                response = self._conn.getresponse()
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                self.close()
+                if reused:
+                    continue
+                raise
+            except (http.client.HTTPException, OSError):
+                self.close()
+                raise
+            try:
+                data = response.read()
+            except (http.client.HTTPException, OSError):
+                self.close()
+                raise
+            if response.will_close:
+                self.close()
+            return response.status, data
+    
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+class RSSSampler:
+    """Samples a process's resident set size from /proc (Linux only)"""
+    
+    def __init__(self, pid, interval=0.2):
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+    
+    def read(self):
+        try:
+            with open(f'/proc/{self.pid}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            return None
+        return None
+    
+    def _run(self):
+        while not self._stop.is_set():
+            rss = self.read()
+            if rss is not None:
+                self.samples.append(rss)
+            self._stop.wait(self.interval)
+    
+    def start(self):
+        self._thread.start()
+    
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        if not self.samples:
+            return None
+        return {
+            'start_mb': round(self.samples[0] / 2 ** 20, 1),
+            'peak_mb': round(max(self.samples) / 2 ** 20, 1),
+            'end_mb': round(self.samples[-1] / 2 ** 20, 1)
+        }
+
+
+class LoadTest:
+    """Runs a request plan against a server and collects the results"""
+    
+    def __init__(self, base_url, plan, seed, concurrency, timeout=120):
+        self.base_url = base_url.rstrip('/')
+        self.plan = plan
+        self.seed = seed
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.key = None
+        self.fixtures = {}
+        self.results = []
+        self._next = 0
+        self._lock = threading.Lock()
+    
+    def prepare(self):
+        """Create a key and one ciphertext per image size for decrypt requests"""
+        client = Client(self.base_url, self.timeout)
+        status, data = client.request('POST', '/api/generate-key')
+        if status != 200:
+            raise RuntimeError(f'Could not generate a key (HTTP {status})')
+        self.key = json.loads(data)['key']
+        
+        for size in sorted({size for _, size in self.plan}):
+            image = make_image(self.seed, size)
+            content_type, body = multipart_body({'key': self.key}, 'file', f'warmup_{size}.png', image)
+            status, data = client.request('POST', '/api/encrypt', body, {'Content-Type': content_type})
+            if status != 200:
+                raise RuntimeError(f'Warm-up encryption of {size} bytes failed (HTTP {status})')
+            self.fixtures[size] = {
+                'image_b64': base64.b64encode(image).decode(),
+                'hash': hashlib.sha256(image).hexdigest(),
+                'encrypted_data': json.loads(data)['encrypted_data']
+            }
+        client.close()
+    
+    def _build_request(self, index, operation, size):
+        """Return (path, body, headers) for one planned request"""
+        fixture = self.fixtures[size]
+        if operation == 'generate-key':
+            return '/api/generate-key', None, {}
+        if operation == 'encrypt':
+            content_type, body = multipart_body(
+                {'key': self.key}, 'file', f'load_{index}.png', make_image(self.seed, size)
+            )
+            return '/api/encrypt', body, {'Content-Type': content_type}
+        if operation == 'decrypt':
+            payload = {'encrypted_data': fixture['encrypted_data'], 'key': self.key}
+            return '/api/decrypt', json.dumps(payload).encode(), {'Content-Type': 'application/json'}
+        if operation == 'verify-hash':
+            payload = {'image_data': fixture['image_b64'], 'hash': fixture['hash']}
+            return '/api/verify-hash', json.dumps(payload).encode(), {'Content-Type': 'application/json'}
+        raise ValueError(f'Unknown operation: {operation}')
+    
+    def _worker(self):
+        client = Client(self.base_url, self.timeout)
+        while True:
+            with self._lock:
+                index = self._next
+                self._next += 1
+            if index >= len(self.plan):
+                break
+            operation, size = self.plan[index]
+            path, body, headers = self._build_request(index, operation, size)
+            started = time.perf_counter()
+            try:
+                status, _ = client.request('POST', path, body, headers)
+                ok = status < 400
+            except Exception:
+                status, ok = None, False
+            latency = time.perf_counter() - started
+            with self._lock:
+                self.results.append((operation, latency, ok, status))
+        client.close()
+    
+    def run(self):
+        """Send the whole plan; returns the wall-clock duration"""
+        threads = [threading.Thread(target=self._worker) for _ in range(self.concurrency)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - started
+
+
+def summarize(results, elapsed):
+    """Latency percentiles (ms), throughput and error rate, overall and per operation"""
+    def stats(rows):
+        latencies = sorted(latency * 1000 for _, latency, _, _ in rows)
+        errors = sum(1 for _, _, ok, _ in rows if not ok)
+        return {
+            'requests': len(rows),
+            'errors': errors,
+            'error_rate': round(errors / len(rows), 4) if rows else 0.0,
+            'throughput_rps': round(len(rows) / elapsed, 2) if elapsed else 0.0,
+            'p50_ms': round(percentile(latencies, 50), 2) if latencies else None,
+            'p95_ms': round(percentile(latencies, 95), 2) if latencies else None,
+            'p99_ms': round(percentile(latencies, 99), 2) if latencies else None,
+            'max_ms': round(latencies[-1], 2) if latencies else None
+        }
+    
+    summary = {'overall': stats(results), 'operations': {}}
+    for operation in OPERATIONS:
+        rows = [row for row in results if row[0] == operation]
+        if rows:
+            summary['operations'][operation] = stats(rows)
+    return summary
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_local_server(port, data_dir, timeout=30):
+    """Start the app in a subprocess and wait until it answers"""
+    process = subprocess.Popen(
+        [sys.executable, __file__, '--serve', '--port', str(port), '--data-dir', data_dir],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('Local server exited during startup')
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/')
+            conn.getresponse().read()
+            conn.close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError('Local server did not start in time')
+
+
+def serve(port, data_dir):
+    """Run the app with Werkzeug's threaded server (used for local runs)"""
+    from werkzeug.serving import run_simple
+    from app import create_app
+    from app.upload_handler import ExpectContinueRequestHandler
+    app = create_app({
+        'UPLOAD_FOLDER': os.path.join(data_dir, 'uploads'),
+        'ENCRYPTED_FOLDER': os.path.join(data_dir, 'encrypted_images'),
+        'CATALOG_DB': os.path.join(data_dir, 'catalog.db'),
+        'JOB_FOLDER': os.path.join(data_dir, 'jobs'),
+        'JOBS_DB': None,
+        'RETENTION_ENABLED': False,
+    })
+    run_simple('127.0.0.1', port, app, threaded=True,
+               request_handler=ExpectContinueRequestHandler)
+
+
+def print_report(report):
+    print(f"\nSeed {report['seed']}, {report['concurrency']} workers, "
+          f"{report['overall']['requests']} requests in {report['elapsed_seconds']}s")
+    header = f"{'operation':<14}{'requests':>9}{'errors':>8}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+    print(header)
+    print('-' * len(header))
+    rows = list(report['operations'].items()) + [('overall', report['overall'])]
+    for name, stats in rows:
+        p50, p95, p99 = ('-' if stats[key] is None else stats[key] for key in ('p50_ms', 'p95_ms', 'p99_ms'))
+        print(f"{name:<14}{stats['requests']:>9}{stats['errors']:>8}{stats['throughput_rps']:>9}"
+              f"{p50:>10}{p95:>10}{p99:>10}")
+    if report['server_rss']:
+        rss = report['server_rss']
+        print(f"\nServer RSS: start {rss['start_mb']} MB, peak {rss['peak_mb']} MB, end {rss['end_mb']} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the PixelLock API')
+    parser.add_argument('--url', help='Target an already running server instead of starting one')
+    parser.add_argument('--server-pid', type=int, help='PID of the target server, for RSS sampling')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--mix', default=DEFAULT_MIX,
+                        help=f'Weighted operation mix (default: {DEFAULT_MIX})')
+    parser.add_argument('--sizes', default=DEFAULT_SIZES,
+                        help=f'Weighted image size distribution (default: {DEFAULT_SIZES})')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--timeout', type=float, default=120, help='Per-request timeout in seconds')
+    parser.add_argument('--json', help='Also write the report to this file')
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--data-dir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    
+    if args.serve:
+        serve(args.port, args.data_dir)
+        return 0
+    
+    mix = parse_weights(args.mix)
+    unknown = [op for op, _ in mix if op not in OPERATIONS]
+    if unknown:
+        parser.error(f"Unknown operation(s) {', '.join(unknown)}; choose from {', '.join(OPERATIONS)}")
+    sizes = parse_weights(args.sizes, parse_size)
+    plan = build_plan(args.seed, args.requests, mix, sizes)
+    
+    process = None
+    data_dir = None
+    base_url = args.url
+    server_pid = args.server_pid
+    
+    try:
+        if base_url is None:
+            data_dir = tempfile.mkdtemp(prefix='pixellock-loadtest-')
+            port = free_port()
+            process = start_local_server(port, data_dir)
+            base_url = f'http://127.0.0.1:{port}'
+            server_pid = process.pid
+        
+        test = LoadTest(base_url, plan, args.seed, args.concurrency, args.timeout)
+        test.prepare()
+        
+        sampler = RSSSampler(server_pid) if server_pid and os.path.exists('/proc') else None
+        if sampler:
+            sampler.start()
+        elapsed = test.run()
+        rss = sampler.stop() if sampler else None
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+        if data_dir is not None:
+            shutil.rmtree(data_dir, ignore_errors=True)
+    
+    report = {
+        'seed': args.seed,
+        'concurrency': args.concurrency,
+        'mix': args.mix,
+        'sizes': args.sizes,
+        'target': base_url,
+        'elapsed_seconds': round(elapsed, 3),
+        'server_rss': rss,
+        **summarize(test.results, elapsed)
+    }
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 0 if report['overall']['errors'] == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
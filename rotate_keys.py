@@ -0,0 +1,57 @@
+"""
+PixelLock 3DES - Key Rotation Script
+Re-encrypts every stored encrypted image from an old key to a new key
+
+Keys are read from the PIXELLOCK_OLD_KEY / PIXELLOCK_NEW_KEY environment
+variables, or prompted for, so they never appear in the process list.
+"""
+
+import argparse
+import getpass
+import json
+import os
+import sys
+
+from app import create_app
+from app.catalog_handler import CatalogHandler
+from app.rotation_handler import KeyRotationJob
+
+
+def main():
+    config = create_app().config
+    
+    parser = argparse.ArgumentParser(description='Rotate the 3DES key of stored encrypted images')
+    parser.add_argument('--folder', default=config['ENCRYPTED_FOLDER'],
+                        help='Folder containing the .enc files')
+    parser.add_argument('--catalog', default=config['CATALOG_DB'],
+                        help='Catalog database recording the key and hash of each file')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 4,
+                        help='Number of files re-encrypted in parallel')
+    parser.add_argument('--checkpoint', help='Checkpoint file (default: inside the folder)')
+    args = parser.parse_args()
+    
+    # Only the catalog tells which key a file is under, so never rotate without it
+    if not os.path.exists(args.catalog):
+        parser.error(f'Catalog database not found: {args.catalog}')
+    
+    old_key = os.environ.get('PIXELLOCK_OLD_KEY') or getpass.getpass('Old key: ')
+    new_key = os.environ.get('PIXELLOCK_NEW_KEY') or getpass.getpass('New key: ')
+    
+    catalog = CatalogHandler(args.catalog)
+    
+    job = KeyRotationJob(
+        args.folder,
+        old_key,
+        new_key,
+        catalog=catalog,
+        checkpoint_path=args.checkpoint,
+        workers=args.workers
+    )
+    result = job.run()
+    
+    print(json.dumps(result, indent=2))
+    return 0 if result['success'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,25 +3,23 @@ PixelLock 3DES - Run Script
 Simplified script to run the application
 """
 
-import os
-import sys
-from pathlib import Path
+from app import create_app
+from app.upload_handler import ExpectContinueRequestHandler
 
-# Add app directory to path
-app_dir = Path(__file__).parent / 'app'
-sys.path.insert(0, str(app_dir))
-
-# Import and run Flask app
-from app import app
+app = create_app()
 
 if __name__ == '__main__':
+    host = app.config.get('HOST', '0.0.0.0')
+    port = app.config.get('PORT', 5000)
+    
     print("=" * 60)
     print("PixelLock 3DES - Secure Image Encryption System")
     print("=" * 60)
     print("\n✓ Starting Flask application...")
-    print("\n📱 Access the application at: http://localhost:5000")
+    print(f"\n📱 Access the application at: http://localhost:{port}")
     print("\n⚠️  To stop the server, press Ctrl+C\n")
     print("=" * 60)
     
     # Run Flask app with debug enabled
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    app.run(debug=True, host=host, port=port,
+            request_handler=ExpectContinueRequestHandler)
@@ -4,17 +4,19 @@ Run tests using: python -m pytest tests.py -v
 """
 
 import unittest
-import sys
 from pathlib import Path
 from io import BytesIO
 from PIL import Image
 
-# Add app directory to path
-app_dir = Path(__file__).parent / 'app'
-sys.path.insert(0, str(app_dir))
-
-from crypto_handler import CryptoHandler
-from hash_handler import HashHandler
+from app import create_app
+from app.crypto_handler import CryptoHandler
+from app.hash_handler import HashHandler, TreeHasher
+from app.catalog_handler import CatalogHandler
+from app.retention_handler import RetentionSweeper
+from app.rotation_handler import KeyRotationJob
+from app.storage_handler import LocalStorage, S3Storage, StorageError
+from app.job_handler import JobQueue
+from app.upload_handler import UploadHandler, StreamUpload, ExpectContinueRequestHandler
 
 
 class TestCryptoHandler(unittest.TestCase):
@@ -79,6 +81,106 @@ class TestCryptoHandler(unittest.TestCase):
             import os
             if os.path.exists(tmp_path):
                 os.remove(tmp_path)
+    
+    
+    def test_reencrypt_stream(self):
+        """Test re-encrypting ciphertext under a new key in small chunks"""
+        import base64
+        old_key = CryptoHandler.generate_key()
+        new_key = CryptoHandler.generate_key()
+        
+        for plaintext in (b"", b"x" * 7, b"y" * 8, self.create_test_image()):
+            with self.subTest(size=len(plaintext)):
+                import tempfile
+                with tempfile.NamedTemporaryFile(delete=False) as tmp:
+                    tmp.write(plaintext)
+                    tmp_path = tmp.name
+                try:
+                    encrypted = CryptoHandler.encrypt_image(tmp_path, old_key)
+                finally:
+                    import os
+                    os.remove(tmp_path)
+                
+                reader = BytesIO(base64.b64decode(encrypted['encrypted_data']))
+                rotated = b"".join(CryptoHandler.reencrypt_stream(reader, old_key, new_key, 24))
+                
+                decrypted = CryptoHandler.decrypt_image(base64.b64encode(rotated), new_key)
+                self.assertTrue(decrypted['success'])
+                self.assertEqual(base64.b64decode(decrypted['decrypted_data']), plaintext)
+    
+    def test_mapped_file_cycle(self):
+        """Test mmap-backed file-to-file encryption and decryption"""
+        import base64
+        import tempfile
+        key = CryptoHandler.generate_key()
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            folder = Path(tmp)
+            for size in (0, 1, 7, 8, 9, 100003):
+                with self.subTest(size=size):
+                    data = bytes(i % 251 for i in range(size))
+                    (folder / 'plain').write_bytes(data)
+                    
+                    result = CryptoHandler.encrypt_file_mapped(
+                        str(folder / 'plain'), str(folder / 'cipher'), key, durability='full')
+                    self.assertTrue(result['success'])
+                    self.assertEqual(result['encrypted_size'], (folder / 'cipher').stat().st_size)
+                    
+                    # Interoperable with the in-memory API
+                    in_memory = CryptoHandler.decrypt_image(
+                        base64.b64encode((folder / 'cipher').read_bytes()), key)
+                    self.assertEqual(base64.b64decode(in_memory['decrypted_data']), data)
+                    
+                    result = CryptoHandler.decrypt_file_mapped(
+                        str(folder / 'cipher'), str(folder / 'out'), key, durability='none')
+                    self.assertTrue(result['success'])
+                    self.assertEqual(result['file_size'], size)
+                    self.assertEqual((folder / 'out').read_bytes(), data)
+    
+    def test_mapped_decrypt_failure_is_atomic(self):
+        """Test that a failed decryption leaves the existing output untouched"""
+        import tempfile
+        key = CryptoHandler.generate_key()
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            folder = Path(tmp)
+            # Pick the IV so the block decrypts to zeros, which is invalid padding
+            from Crypto.Cipher import DES3
+            block = b'\x01' * 8
+            iv = DES3.new(CryptoHandler.validate_key(key), DES3.MODE_ECB).decrypt(block)
+            (folder / 'cipher').write_bytes(iv + block)
+            (folder / 'out').write_bytes(b'previous')
+            
+            result = CryptoHandler.decrypt_file_mapped(
+                str(folder / 'cipher'), str(folder / 'out'), key)
+            self.assertFalse(result['success'])
+            self.assertEqual((folder / 'out').read_bytes(), b'previous')
+            self.assertEqual(sorted(p.name for p in folder.iterdir()), ['cipher', 'out'])
+            
+            (folder / 'plain').write_bytes(b'data')
+            result = CryptoHandler.encrypt_file_mapped(
+                str(folder / 'plain'), str(folder / 'out'), key, durability='sometimes')
+            self.assertFalse(result['success'])
+    
+    def test_iter_encrypt(self):
+        """Test streaming encryption matches the in-memory format"""
+        import base64
+        key = CryptoHandler.generate_key()
+        data = self.create_test_image()
+        seen = []
+        
+        encrypted = b"".join(CryptoHandler.iter_encrypt(BytesIO(data), key, 64, seen.append))
+        self.assertEqual(len(encrypted), 8 + (len(data) // 8 + 1) * 8)
+        self.assertEqual(seen[-1], len(data))
+        
+        decrypted = CryptoHandler.decrypt_image(base64.b64encode(encrypted), key)
+        self.assertEqual(base64.b64decode(decrypted['decrypted_data']), data)
+    
+    def test_reencrypt_stream_truncated(self):
+        """Test that truncated ciphertext is rejected"""
+        key = CryptoHandler.generate_key()
+        with self.assertRaises(ValueError):
+            list(CryptoHandler.reencrypt_stream(BytesIO(b"0" * 12), key, key))
 
 
 class TestHashHandler(unittest.TestCase):
@@ -141,6 +243,1116 @@ class TestHashHandler(unittest.TestCase):
         verify_result = HashHandler.verify_hash_data(data, wrong_hash)
         self.assertTrue(verify_result['success'])
         self.assertFalse(verify_result['matches'])
+    
+    def test_verify_digest(self):
+        """Test verification of a client-computed digest"""
+        digest = HashHandler.generate_hash_from_data(b"test data")['hash']
+        
+        verify_result = HashHandler.verify_digest(digest.upper(), digest)
+        self.assertTrue(verify_result['success'])
+        self.assertTrue(verify_result['matches'])
+        
+        verify_result = HashHandler.verify_digest(digest, "0" * 64)
+        self.assertTrue(verify_result['success'])
+        self.assertFalse(verify_result['matches'])
+    
+    def test_verify_digest_invalid(self):
+        """Test that malformed digests are rejected"""
+        verify_result = HashHandler.verify_digest("not-a-digest", "0" * 64)
+        self.assertFalse(verify_result['success'])
+
+
+class TestTreeHash(unittest.TestCase):
+    """Test cases for tree (Merkle) hashing"""
+    
+    def setUp(self):
+        """Write a file spanning several chunks"""
+        import tempfile
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmp_dir.name) / 'image.bin'
+        self.data = bytes(i % 253 for i in range(10 * 1000 + 123))
+        self.path.write_bytes(self.data)
+        self.tree = HashHandler.generate_tree_hash(str(self.path), chunk_size=1000, workers=4)
+    
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+    
+    def corrupt(self, offset):
+        data = bytearray(self.data)
+        data[offset] ^= 0xFF
+        self.path.write_bytes(bytes(data))
+    
+    def test_generate_tree_hash(self):
+        """Test tree shape and determinism"""
+        self.assertTrue(self.tree['success'])
+        self.assertEqual(len(self.tree['leaves']), 11)
+        self.assertEqual(self.tree['file_size'], len(self.data))
+        self.assertEqual(HashHandler.merkle_root(self.tree['leaves']), self.tree['root'])
+        again = HashHandler.generate_tree_hash(str(self.path), chunk_size=1000, workers=1)
+        self.assertEqual(again['root'], self.tree['root'])
+    
+    def test_single_pass_hasher(self):
+        """Test that streaming hashing matches the file-based hashes"""
+        import io
+        for data in [self.data, self.data[:3000], b'']:
+            self.path.write_bytes(data)
+            hasher = TreeHasher(chunk_size=1000)
+            reader = hasher.reader(io.BytesIO(data))
+            while reader.read(777):
+                pass
+            hash_result, tree_result = hasher.results()
+            self.assertEqual(hash_result['hash'], HashHandler.generate_hash(str(self.path))['hash'])
+            expected = HashHandler.generate_tree_hash(str(self.path), chunk_size=1000)
+            self.assertEqual(tree_result['leaves'], expected['leaves'])
+            self.assertEqual(tree_result['root'], expected['root'])
+            self.assertEqual(tree_result['file_size'], len(data))
+    
+    def test_empty_file(self):
+        """Test that an empty file has a single leaf"""
+        empty = Path(self.tmp_dir.name) / 'empty.bin'
+        empty.write_bytes(b'')
+        tree = HashHandler.generate_tree_hash(str(empty))
+        self.assertEqual(len(tree['leaves']), 1)
+        self.assertTrue(HashHandler.verify_hash(str(empty), tree['root'], tree=tree)['matches'])
+    
+    def test_locate_corruption(self):
+        """Test that verification reports the corrupted region"""
+        self.corrupt(4500)
+        
+        result = HashHandler.verify_hash(str(self.path), self.tree['root'], tree=self.tree)
+        self.assertTrue(result['success'])
+        self.assertFalse(result['matches'])
+        self.assertEqual(result['corrupted_chunks'], [4])
+        self.assertEqual(result['corrupted_ranges'], [[4000, 5000]])
+    
+    def test_partial_verification(self):
+        """Test checking only some chunks or a byte range"""
+        self.corrupt(9999)
+        
+        clean = HashHandler.verify_tree_hash(str(self.path), self.tree, byte_range=(0, 2500))
+        self.assertTrue(clean['matches'])
+        self.assertEqual(clean['checked_chunks'], 3)
+        
+        dirty = HashHandler.verify_tree_hash(str(self.path), self.tree, chunks=[1, 9])
+        self.assertFalse(dirty['matches'])
+        self.assertEqual(dirty['corrupted_chunks'], [9])
+    
+    def test_tampered_tree(self):
+        """Test that leaves not matching the root are rejected"""
+        tree = dict(self.tree, leaves=['0' * 64] + self.tree['leaves'][1:])
+        self.assertFalse(HashHandler.verify_tree_hash(str(self.path), tree)['success'])
+        self.assertFalse(HashHandler.verify_hash(str(self.path), '0' * 64, tree=self.tree)['success'])
+
+
+class TestCatalogHandler(unittest.TestCase):
+    """Test cases for CatalogHandler"""
+    
+    def setUp(self):
+        """Set up a catalog in a temporary directory"""
+        import tempfile
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.catalog = CatalogHandler(str(Path(self.tmp_dir.name) / 'catalog.db'))
+    
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+    
+    def add(self, name, content_hash="a" * 64):
+        return self.catalog.add_file(
+            filename=name,
+            encrypted_filename=f"encrypted_{name}.enc",
+            original_hash=content_hash,
+            file_size=100,
+            encrypted_size=112,
+            key_id="0123456789abcdef"
+        )
+    
+    def test_add_and_get(self):
+        """Test recording and looking up a file"""
+        record = self.add("photo.png")
+        self.assertEqual(self.catalog.get_file(record['id']), record)
+        self.assertEqual(record['encrypted_filename'], "encrypted_photo.png.enc")
+        self.assertIsNone(self.catalog.get_file(record['id'] + 1))
+    
+    def test_replace_same_encrypted_filename(self):
+        """Test that re-encrypting a filename replaces its record"""
+        self.add("photo.png")
+        self.add("photo.png", content_hash="b" * 64)
+        result = self.catalog.list_files()
+        self.assertEqual(result['count'], 1)
+        self.assertEqual(result['files'][0]['original_hash'], "b" * 64)
+    
+    def test_pagination(self):
+        """Test keyset pagination returns every record exactly once"""
+        for i in range(5):
+            self.add(f"img{i}.png")
+        
+        seen = []
+        cursor = None
+        while True:
+            page = self.catalog.list_files(limit=2, cursor=cursor)
+            self.assertTrue(page['success'])
+            seen.extend(f['filename'] for f in page['files'])
+            cursor = page['next_cursor']
+            if cursor is None:
+                break
+        
+        self.assertEqual(seen, [f"img{i}.png" for i in reversed(range(5))])
+    
+    def test_tree_storage(self):
+        """Test storing tree hashes alongside records"""
+        record = self.add("photo.png")
+        tree = {'root': "r" * 64, 'chunk_size': 1000, 'file_size': 1500, 'leaves': ["a" * 64, "b" * 64]}
+        self.catalog.set_tree(record['id'], tree)
+        self.assertEqual(self.catalog.get_tree(record['id']), tree)
+        
+        # Replacing the record drops its tree
+        self.add("photo.png")
+        self.assertIsNone(self.catalog.get_tree(record['id']))
+    
+    def test_search(self):
+        """Test searching by hash and filename prefix"""
+        self.add("cat.png", content_hash="c" * 64)
+        self.add("car.png")
+        self.add("dog.png")
+        
+        by_hash = self.catalog.search_files(content_hash="C" * 64)
+        self.assertEqual([f['filename'] for f in by_hash['files']], ["cat.png"])
+        
+        by_prefix = self.catalog.search_files(filename="ca", prefix=True)
+        self.assertEqual(sorted(f['filename'] for f in by_prefix['files']),
+                         ["car.png", "cat.png"])
+        
+        self.assertTrue(self.catalog.delete_file("encrypted_dog.png.enc"))
+        self.assertEqual(self.catalog.search_files(filename="dog.png")['count'], 0)
+    
+    def test_search_pagination(self):
+        """Test paging through prefix and time range searches"""
+        for position, i in enumerate((3, 1, 4, 0, 2)):
+            record = self.add(f"img{i}.png")
+            with self.catalog._connect() as conn:
+                conn.execute('UPDATE files SET created_at = ? WHERE id = ?', (100 + position, record['id']))
+        
+        def collect(**kwargs):
+            seen, cursor = [], None
+            while True:
+                page = self.catalog.search_files(limit=2, cursor=cursor, **kwargs)
+                self.assertTrue(page['success'])
+                seen.extend(f['filename'] for f in page['files'])
+                cursor = page['next_cursor']
+                if cursor is None:
+                    return seen
+        
+        self.assertEqual(collect(filename="img", prefix=True),
+                         [f"img{i}.png" for i in range(5)])
+        self.assertEqual(collect(since=101, until=104),
+                         ["img0.png", "img4.png", "img1.png"])
+    
+    def test_search_query_plan(self):
+        """Test that searches are answered from an index in sort order"""
+        conn = self.catalog._connect()
+        cursors = {'id': '10', 'prefix': CatalogHandler._encode_cursor('img5', 10),
+                   'time': CatalogHandler._encode_cursor(1.5, 10)}
+        queries = [
+            ({}, 'id'),
+            ({'content_hash': "a" * 64}, 'id'),
+            ({'filename': "img.png"}, 'id'),
+            ({'filename': "img", 'prefix': True}, 'prefix'),
+            ({'since': 1.0}, 'time'),
+            ({'until': 2.0}, 'time'),
+            ({'since': 1.0, 'until': 2.0}, 'time'),
+        ]
+        for kwargs, kind in queries:
+            for cursor in (None, cursors[kind]):
+                with self.subTest(kwargs=kwargs, cursor=cursor):
+                    sql, params, _ = self.catalog._search_query(cursor=cursor, **kwargs)
+                    plan = ' '.join(row[-1] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params + [1]))
+                    self.assertNotIn('TEMP B-TREE', plan)
+                    if kwargs:
+                        self.assertIn('USING', plan)
+
+
+class TestRetentionSweeper(unittest.TestCase):
+    """Test cases for RetentionSweeper"""
+    
+    def setUp(self):
+        """Set up upload and encrypted folders in a temporary directory"""
+        import tempfile
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        root = Path(self.tmp_dir.name)
+        self.uploads = root / 'uploads'
+        self.encrypted = root / 'encrypted'
+        self.uploads.mkdir()
+        self.encrypted.mkdir()
+        self.catalog = CatalogHandler(str(root / 'catalog.db'))
+    
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+    
+    def make_file(self, folder, name, size, age):
+        """Create a file of the given size whose mtime is age seconds ago"""
+        import os
+        import time
+        path = folder / name
+        path.write_bytes(b"\0" * size)
+        mtime = time.time() - age
+        os.utime(path, (mtime, mtime))
+        return path
+    
+    def sweeper(self, **kwargs):
+        kwargs.setdefault('deletes_per_second', None)
+        return RetentionSweeper(str(self.encrypted), str(self.uploads),
+                                catalog=self.catalog, **kwargs)
+    
+    def test_orphan_uploads(self):
+        """Test that only stale uploads are removed"""
+        stale = self.make_file(self.uploads, 'stale.png', 10, age=7200)
+        fresh = self.make_file(self.uploads, 'fresh.png', 10, age=10)
+        
+        result = self.sweeper(orphan_upload_age=3600).sweep()
+        self.assertTrue(result['success'])
+        self.assertEqual(result['orphan_uploads_deleted'], 1)
+        self.assertFalse(stale.exists())
+        self.assertTrue(fresh.exists())
+    
+    def test_orphan_job_uploads(self):
+        """Test that stale job uploads are removed unless a job still needs them"""
+        jobs = self.uploads / 'jobs'
+        jobs.mkdir()
+        lost = self.make_file(jobs, 'abc_photo.png', 10, age=7200)
+        queued = self.make_file(jobs, 'def_photo.png', 10, age=7200)
+        fresh = self.make_file(jobs, 'ghi_photo.png', 10, age=10)
+        
+        result = self.sweeper(orphan_upload_age=3600, job_folder=str(jobs),
+                              job_uploads_in_use=lambda: {'def_photo.png'}).sweep()
+        self.assertEqual(result['orphan_uploads_deleted'], 1)
+        self.assertFalse(lost.exists())
+        self.assertTrue(queued.exists())
+        self.assertTrue(fresh.exists())
+    
+    def test_max_age(self):
+        """Test age-based retention also drops catalog records"""
+        old = self.make_file(self.encrypted, 'encrypted_old.png.enc', 10, age=100)
+        new = self.make_file(self.encrypted, 'encrypted_new.png.enc', 10, age=1)
+        self.catalog.add_file('old.png', old.name, "a" * 64, 8, 10)
+        
+        result = self.sweeper(max_age=50).sweep()
+        self.assertEqual(result['deleted_files'], 1)
+        self.assertFalse(old.exists())
+        self.assertTrue(new.exists())
+        self.assertIsNone(self.catalog.get_by_encrypted_filename(old.name))
+    
+    def test_max_total_bytes(self):
+        """Test size-based retention removes the oldest files first"""
+        paths = [self.make_file(self.encrypted, f'encrypted_{i}.enc', 100, age=100 - i)
+                 for i in range(4)]
+        
+        result = self.sweeper(max_total_bytes=250).sweep()
+        self.assertEqual(result['deleted_files'], 2)
+        self.assertEqual(result['freed_bytes'], 200)
+        self.assertEqual([p.exists() for p in paths], [False, False, True, True])
+    
+    def test_disk_watermark(self):
+        """Test that crossing the high watermark frees space down to the low one"""
+        paths = [self.make_file(self.encrypted, f'encrypted_{i}.enc', 100, age=100 - i)
+                 for i in range(3)]
+        sweeper = self.sweeper(high_watermark=0.9)
+        sweeper._bytes_over_watermark = lambda: (50, 150)
+        
+        result = sweeper.sweep()
+        self.assertEqual(result['deleted_files'], 2)
+        self.assertFalse(result['watermark_unreachable'])
+        self.assertEqual([p.exists() for p in paths], [False, False, True])
+    
+    def test_disk_watermark_unreachable(self):
+        """Test that files are kept when other data keeps the disk full"""
+        paths = [self.make_file(self.encrypted, f'encrypted_{i}.enc', 100, age=100 - i)
+                 for i in range(3)]
+        sweeper = self.sweeper(high_watermark=0.9)
+        sweeper._bytes_over_watermark = lambda: (400, 500)
+        
+        result = sweeper.sweep()
+        self.assertEqual(result['deleted_files'], 0)
+        self.assertTrue(result['watermark_unreachable'])
+        self.assertTrue(all(p.exists() for p in paths))
+    
+    def test_invalid_watermarks(self):
+        """Test watermark validation and that the watermark is off by default"""
+        with self.assertRaises(ValueError):
+            self.sweeper(high_watermark=0.5, low_watermark=0.8)
+        self.assertEqual(self.sweeper()._bytes_over_watermark(), (0, 0))
+
+
+class TestKeyRotationJob(unittest.TestCase):
+    """Test cases for KeyRotationJob"""
+    
+    def setUp(self):
+        """Encrypt a few files with an old key into a temporary folder"""
+        import hashlib
+        import tempfile
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.folder = Path(self.tmp_dir.name)
+        self.old_key = CryptoHandler.generate_key()
+        self.new_key = CryptoHandler.generate_key()
+        self.catalog = CatalogHandler(str(self.folder / 'catalog.db'))
+        self.plaintexts = {f"encrypted_{i}.png.enc": bytes([i]) * (1000 * i + 3)
+                           for i in range(4)}
+        for name, data in self.plaintexts.items():
+            source = self.folder / 'plain.tmp'
+            source.write_bytes(data)
+            CryptoHandler.encrypt_image_file(str(source), str(self.folder / name), self.old_key)
+            source.unlink()
+            self.catalog.add_file(name[len('encrypted_'):-len('.enc')], name,
+                                  hashlib.sha256(data).hexdigest(), len(data), 0,
+                                  key_id=CryptoHandler.key_fingerprint(self.old_key))
+    
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+    
+    def rotate(self, old_key=None, new_key=None, **kwargs):
+        return KeyRotationJob(str(self.folder), old_key or self.old_key, new_key or self.new_key,
+                              catalog=self.catalog, **kwargs)
+    
+    def assertRotated(self, names=None):
+        for name in names or self.plaintexts:
+            output = self.folder / 'check.tmp'
+            result = CryptoHandler.decrypt_image_file(
+                str(self.folder / name), str(output), self.new_key)
+            self.assertTrue(result['success'], name)
+            self.assertEqual(output.read_bytes(), self.plaintexts[name])
+            output.unlink()
+    
+    def test_rotate_all(self):
+        """Test that every file ends up under the new key"""
+        result = self.rotate(workers=2, chunk_size=64).run()
+        self.assertTrue(result['success'])
+        self.assertEqual(result['rotated_files'], 4)
+        self.assertEqual(result['skipped_files'], [])
+        self.assertRotated()
+        self.assertEqual(self.catalog.get_by_encrypted_filename('encrypted_0.png.enc')['key_id'],
+                         CryptoHandler.key_fingerprint(self.new_key))
+        
+        # Running the same rotation again is a no-op
+        result = self.rotate().run()
+        self.assertTrue(result['success'])
+        self.assertEqual(result['rotated_files'], 0)
+        self.assertRotated()
+    
+    def test_rotate_back_to_earlier_key(self):
+        """Test that rotating back to a key used before rotates again"""
+        third_key = CryptoHandler.generate_key()
+        for old_key, new_key in [(self.old_key, self.new_key), (self.new_key, third_key),
+                                 (third_key, self.new_key)]:
+            result = self.rotate(old_key, new_key).run()
+            self.assertTrue(result['success'])
+            self.assertEqual(result['rotated_files'], 4)
+        self.assertRotated()
+    
+    def test_restored_file_is_rotated(self):
+        """Test that a file stored again after a run is not skipped"""
+        import os
+        self.assertTrue(self.rotate().run()['success'])
+        
+        name = 'encrypted_2.png.enc'
+        source = self.folder / 'plain.tmp'
+        source.write_bytes(self.plaintexts[name])
+        CryptoHandler.encrypt_image_file(str(source), str(self.folder / name), self.old_key)
+        source.unlink()
+        os.utime(self.folder / name, ns=(1, 1))
+        self.catalog.update_key_id(name, CryptoHandler.key_fingerprint(self.old_key))
+        
+        result = self.rotate().run()
+        self.assertTrue(result['success'])
+        self.assertEqual(result['rotated_files'], 1)
+        self.assertRotated()
+    
+    def test_resume_after_crash(self):
+        """Test resuming a run that stopped after staging a file"""
+        job = self.rotate()
+        name = 'encrypted_1.png.enc'
+        
+        # Simulate a crash between staging the output and renaming it
+        job._commit = lambda n: None
+        job._rotate_file(name)
+        self.assertTrue((self.folder / (name + KeyRotationJob.TEMP_SUFFIX)).exists())
+        
+        result = self.rotate().run()
+        self.assertTrue(result['success'])
+        self.assertEqual(result['resumed_files'], 1)
+        self.assertEqual(result['rotated_files'], 3)
+        self.assertRotated()
+    
+    def test_wrong_old_key(self):
+        """Test that files not under the old key are reported and left intact"""
+        before = {name: (self.folder / name).read_bytes() for name in self.plaintexts}
+        for name in self.plaintexts:
+            self.catalog.update_key_id(name, None)
+        
+        result = self.rotate(self.new_key, self.old_key).run()
+        self.assertFalse(result['success'])
+        self.assertEqual(len(result['failed_files']), 4)
+        for name, data in before.items():
+            self.assertEqual((self.folder / name).read_bytes(), data)
+        self.assertEqual(list(self.folder.glob('*' + KeyRotationJob.TEMP_SUFFIX)), [])
+    
+    def test_padding_collision_is_caught(self):
+        """Test that a ciphertext passing the wrong key's padding check is not rotated"""
+        import io
+        other_key = CryptoHandler.generate_key()
+        name = 'encrypted_1.png.enc'
+        data = self.plaintexts[name]
+        
+        # Re-encrypt under another key until the old key happens to unpad it
+        while True:
+            ciphertext = b''.join(CryptoHandler.iter_encrypt(io.BytesIO(data), other_key))
+            try:
+                b''.join(CryptoHandler.reencrypt_stream(io.BytesIO(ciphertext),
+                                                        self.old_key, self.new_key))
+                break
+            except ValueError:
+                continue
+        (self.folder / name).write_bytes(ciphertext)
+        
+        result = self.rotate().run()
+        self.assertFalse(result['success'])
+        self.assertEqual([f['file'] for f in result['failed_files']], [name])
+        self.assertEqual((self.folder / name).read_bytes(), ciphertext)
+        self.assertEqual(result['rotated_files'], 3)
+    
+    def test_other_keys_are_skipped(self):
+        """Test that files under a third key or without a record are skipped"""
+        self.catalog.update_key_id('encrypted_0.png.enc', 'ffffffffffffffff')
+        self.catalog.delete_file('encrypted_3.png.enc')
+        before = {name: (self.folder / name).read_bytes()
+                  for name in ('encrypted_0.png.enc', 'encrypted_3.png.enc')}
+        
+        result = self.rotate().run()
+        self.assertTrue(result['success'])
+        self.assertEqual(result['rotated_files'], 2)
+        self.assertEqual(result['skipped_files'], [
+            {'file': 'encrypted_0.png.enc', 'reason': 'Encrypted with another key'},
+            {'file': 'encrypted_3.png.enc', 'reason': 'No catalog record'},
+        ])
+        for name, data in before.items():
+            self.assertEqual((self.folder / name).read_bytes(), data)
+        self.assertRotated(['encrypted_1.png.enc', 'encrypted_2.png.enc'])
+
+
+class TestJobQueue(unittest.TestCase):
+    """Test cases for JobQueue"""
+    
+    def setUp(self):
+        import tempfile
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = str(Path(self.tmp_dir.name) / 'jobs.db')
+        self.queues = []
+    
+    def tearDown(self):
+        for job_queue in self.queues:
+            job_queue.stop(timeout=5)
+        self.tmp_dir.cleanup()
+    
+    def make_queue(self, handler, **kwargs):
+        job_queue = JobQueue({'work': handler}, **kwargs)
+        self.queues.append(job_queue)
+        return job_queue
+    
+    @staticmethod
+    def handler(job, secrets, progress):
+        for processed in range(0, job['total_bytes'] + 1, 10):
+            progress(processed)
+        return {'echo': job['payload']['value'], 'secret': secrets['token']}
+    
+    def test_complete_job(self):
+        """Test that a job runs in the background and stores its result"""
+        for db_path in (None, self.db_path):
+            with self.subTest(db_path=db_path):
+                job_queue = self.make_queue(self.handler, db_path=db_path)
+                job_id = job_queue.submit('work', {'value': 42}, secrets={'token': 't'}, total_bytes=100)
+                
+                job = job_queue.wait(job_id, timeout=5)
+                self.assertEqual(job['state'], JobQueue.COMPLETED)
+                self.assertEqual(job['result'], {'echo': 42, 'secret': 't'})
+                self.assertEqual(job['bytes_processed'], 100)
+    
+    def test_failed_job(self):
+        """Test that handler errors fail the job with their message"""
+        def failing(job, secrets, progress):
+            raise ValueError('bad input')
+        
+        job_queue = self.make_queue(failing)
+        job = job_queue.wait(job_queue.submit('work', {}), timeout=5)
+        self.assertEqual(job['state'], JobQueue.FAILED)
+        self.assertEqual(job['error'], 'bad input')
+        
+        with self.assertRaises(ValueError):
+            job_queue.submit('unknown', {})
+    
+    def test_shared_store_isolation(self):
+        """Test that queues sharing a database never touch each other's jobs"""
+        import threading
+        import time
+        release = threading.Event()
+        
+        def blocking(job, secrets, progress):
+            release.wait(5)
+            return {}
+        
+        first = self.make_queue(blocking, db_path=self.db_path, workers=1, lease=0.3)
+        running = first.submit('work', {'value': 1}, secrets={'token': 't'})
+        queued = first.submit('work', {'value': 2}, secrets={'token': 't'})
+        while first.get(running)['state'] != JobQueue.RUNNING:
+            time.sleep(0.01)
+        
+        # Another live process starts on the same database
+        abandoned = []
+        second = self.make_queue(self.handler, db_path=self.db_path, lease=0.3,
+                                 on_abandon=abandoned.append)
+        second.start()
+        time.sleep(1)
+        self.assertEqual(second.get(running)['state'], JobQueue.RUNNING)
+        self.assertEqual(second.get(queued)['state'], JobQueue.QUEUED)
+        self.assertEqual(abandoned, [])
+        
+        release.set()
+        for job_id in (running, queued):
+            self.assertEqual(first.wait(job_id, timeout=5)['state'], JobQueue.COMPLETED)
+    
+    def test_restart_without_secrets(self):
+        """Test that a dead queue's jobs are taken over but never store secrets"""
+        import sqlite3
+        
+        first = self.make_queue(self.handler, db_path=self.db_path, workers=0, lease=0.2)
+        job_id = first.submit('work', {'value': 1}, secrets={'token': 'secret-key'})
+        
+        stored = sqlite3.connect(self.db_path).execute('SELECT payload FROM jobs').fetchall()
+        self.assertNotIn('secret-key', repr(stored))
+        
+        # The first process dies: its lease is no longer renewed
+        first.stop()
+        abandoned = []
+        second = self.make_queue(self.handler, db_path=self.db_path, lease=0.2,
+                                 on_abandon=abandoned.append)
+        second.start()
+        job = second.wait(job_id, timeout=5)
+        self.assertEqual(job['state'], JobQueue.FAILED)
+        self.assertIn('resubmit', job['error'])
+        self.assertEqual([j['id'] for j in abandoned], [job_id])
+
+
+class FakeS3Server:
+    """Minimal in-memory S3 stand-in for object and multipart requests"""
+    
+    def __init__(self):
+        import threading
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        from urllib.parse import parse_qs, unquote, urlsplit
+        
+        objects = self.objects = {}
+        uploads = self.uploads = {}
+        requests = self.requests = []
+        
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            
+            def log_message(self, *args):
+                pass
+            
+            def reply(self, status, body=b'', headers=None):
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                if self.command != 'HEAD':
+                    self.wfile.write(body)
+            
+            def handle_one(self):
+                parts = urlsplit(self.path)
+                key = unquote(parts.path)
+                query = {k: v[0] for k, v in parse_qs(parts.query, keep_blank_values=True).items()}
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                requests.append((self.command, key, query, self.headers.get('Authorization', '')))
+                
+                if self.command == 'POST' and 'uploads' in query:
+                    upload_id = f'upload-{len(uploads)}'
+                    uploads[upload_id] = {}
+                    return self.reply(200, (
+                        '<InitiateMultipartUploadResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">'
+                        f'<UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>'
+                    ).encode())
+                if self.command == 'PUT' and 'uploadId' in query:
+                    uploads[query['uploadId']][int(query['partNumber'])] = body
+                    return self.reply(200, headers={'ETag': f'"etag-{query["partNumber"]}"'})
+                if self.command == 'POST' and 'uploadId' in query:
+                    parts_ = uploads.pop(query['uploadId'])
+                    objects[key] = b''.join(parts_[n] for n in sorted(parts_))
+                    return self.reply(200, b'<CompleteMultipartUploadResult/>')
+                if self.command == 'DELETE' and 'uploadId' in query:
+                    uploads.pop(query['uploadId'], None)
+                    return self.reply(204)
+                if self.command == 'PUT':
+                    objects[key] = body
+                    return self.reply(200, headers={'ETag': '"etag"'})
+                if key not in objects:
+                    return self.reply(404, b'<Error><Code>NoSuchKey</Code></Error>')
+                if self.command == 'DELETE':
+                    del objects[key]
+                    return self.reply(204)
+                data = objects[key]
+                if self.command == 'HEAD':
+                    self.send_response(200)
+                    self.send_header('Content-Length', str(len(data)))
+                    self.end_headers()
+                    return
+                byte_range = self.headers.get('Range')
+                if byte_range:
+                    start, _, end = byte_range[len('bytes='):].partition('-')
+                    end = int(end) if end else len(data) - 1
+                    return self.reply(206, data[int(start):end + 1])
+                return self.reply(200, data)
+            
+            do_GET = do_PUT = do_POST = do_HEAD = do_DELETE = handle_one
+        
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+    
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TestStorage(unittest.TestCase):
+    """Test cases for the storage backends"""
+    
+    def setUp(self):
+        import tempfile
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.s3_server = FakeS3Server()
+        self.s3 = S3Storage(self.s3_server.url, 'bucket', 'access', 'secret')
+    
+    def tearDown(self):
+        self.s3.close()
+        self.s3_server.close()
+        self.tmp_dir.cleanup()
+    
+    def check_backend(self, storage):
+        data = bytes(range(256)) * 40
+        self.assertEqual(storage.write('obj.enc', [data[:1000], data[1000:]]), len(data))
+        self.assertTrue(storage.exists('obj.enc'))
+        self.assertEqual(storage.size('obj.enc'), len(data))
+        self.assertEqual(storage.read('obj.enc'), data)
+        self.assertEqual(storage.read('obj.enc', 100, 50), data[100:150])
+        self.assertEqual(b''.join(storage.iter_read('obj.enc', 10, chunk_size=333)), data[10:])
+        self.assertTrue(storage.delete('obj.enc'))
+        self.assertFalse(storage.exists('obj.enc'))
+        with self.assertRaises(StorageError):
+            storage.read('obj.enc')
+    
+    def test_local_storage(self):
+        """Test the local filesystem backend"""
+        storage = LocalStorage(self.tmp_dir.name)
+        self.check_backend(storage)
+        with self.assertRaises(StorageError):
+            storage.write('../escape.enc', [b'x'])
+    
+    def test_local_storage_file_mode(self):
+        """Test that stored and decrypted files get the umask's mode, like open()"""
+        import os
+        key = CryptoHandler.generate_key()
+        source = Path(self.tmp_dir.name) / 'plain.bin'
+        source.write_bytes(b'data' * 100)
+        old_umask = os.umask(0o027)
+        try:
+            LocalStorage(self.tmp_dir.name).write('obj.enc', [b'abc'])
+            CryptoHandler.encrypt_image_file(str(source), str(source) + '.enc', key)
+            CryptoHandler.decrypt_image_file(str(source) + '.enc', str(source) + '.out', key)
+        finally:
+            os.umask(old_umask)
+        for name in ('obj.enc', 'plain.bin.enc', 'plain.bin.out'):
+            self.assertEqual(os.stat(Path(self.tmp_dir.name) / name).st_mode & 0o777, 0o640, name)
+    
+    def test_local_storage_durability(self):
+        """Test that local writes are fsynced according to the policy"""
+        from unittest import mock
+        import os
+        for durability, expected_syncs in [('none', 0), ('file', 1), ('full', 2)]:
+            storage = LocalStorage(self.tmp_dir.name, durability)
+            with mock.patch('app.storage_handler.os.fsync', wraps=os.fsync) as fsync:
+                self.assertEqual(storage.write('obj.enc', [b'abc', b'def']), 6)
+            self.assertEqual(fsync.call_count, expected_syncs)
+            self.assertEqual(storage.read('obj.enc'), b'abcdef')
+        with self.assertRaises(ValueError):
+            LocalStorage(self.tmp_dir.name, 'sometimes')
+    
+    def test_s3_storage(self):
+        """Test the S3 backend against a local stand-in server"""
+        self.check_backend(self.s3)
+        self.assertTrue(all(auth.startswith('AWS4-HMAC-SHA256 Credential=access/')
+                            for _, _, _, auth in self.s3_server.requests))
+    
+    def test_s3_multipart_upload(self):
+        """Test that large writes are streamed as a multipart upload"""
+        self.s3.part_size = 1000
+        chunks = [bytes([i]) * 700 for i in range(5)]
+        self.assertEqual(self.s3.write('big.enc', chunks), 3500)
+        self.assertEqual(self.s3_server.objects['/bucket/big.enc'], b''.join(chunks))
+        part_uploads = [q for method, _, q, _ in self.s3_server.requests
+                        if method == 'PUT' and 'partNumber' in q]
+        self.assertEqual(len(part_uploads), 4)
+    
+    def test_s3_multipart_abort(self):
+        """Test that a failed streaming write aborts the multipart upload"""
+        self.s3.part_size = 100
+        
+        def chunks():
+            yield b'x' * 250
+            raise RuntimeError('encryption failed')
+        
+        with self.assertRaises(RuntimeError):
+            self.s3.write('broken.enc', chunks())
+        self.assertEqual(self.s3_server.uploads, {})
+        self.assertFalse(self.s3.exists('broken.enc'))
+
+
+class TestLoadTestHarness(unittest.TestCase):
+    """Test cases for the load generator's planning and statistics"""
+    
+    def setUp(self):
+        import loadtest
+        self.loadtest = loadtest
+    
+    def test_plan_is_reproducible(self):
+        """Test that the same seed always yields the same traffic"""
+        mix = self.loadtest.parse_weights('encrypt=3,generate-key=1')
+        sizes = self.loadtest.parse_weights('1KB=1,2MB=1', self.loadtest.parse_size)
+        self.assertEqual(sizes, [(1024, 1.0), (2 * 1024 * 1024, 1.0)])
+        
+        plan = self.loadtest.build_plan(7, 50, mix, sizes)
+        self.assertEqual(plan, self.loadtest.build_plan(7, 50, mix, sizes))
+        self.assertNotEqual(plan, self.loadtest.build_plan(8, 50, mix, sizes))
+        self.assertEqual(self.loadtest.make_image(7, 100), self.loadtest.make_image(7, 100))
+        self.assertTrue(self.loadtest.make_image(7, 100).startswith(b'\x89PNG'))
+    
+    def test_percentiles(self):
+        """Test nearest-rank percentiles and the summary"""
+        values = list(range(1, 101))
+        self.assertEqual(self.loadtest.percentile(values, 50), 50)
+        self.assertEqual(self.loadtest.percentile(values, 99), 99)
+        self.assertEqual(self.loadtest.percentile([5], 95), 5)
+        self.assertIsNone(self.loadtest.percentile([], 50))
+        
+        results = [('encrypt', 0.010, True, 200), ('encrypt', 0.030, False, 500),
+                   ('generate-key', 0.001, True, 200)]
+        summary = self.loadtest.summarize(results, elapsed=1.0)
+        self.assertEqual(summary['overall']['requests'], 3)
+        self.assertEqual(summary['operations']['encrypt']['errors'], 1)
+        self.assertEqual(summary['operations']['encrypt']['p99_ms'], 30.0)
+    
+    def serve_raw(self, respond):
+        """Accept connections on a local socket, counting the requests received"""
+        import socket
+        import threading
+        server = socket.socket()
+        server.bind(('127.0.0.1', 0))
+        server.listen()
+        received = []
+        
+        def handle(conn):
+            with conn:
+                data = b''
+                while b'\r\n\r\n' not in data:
+                    chunk = conn.recv(4096)
+                    if not chunk:
+                        return
+                    data += chunk
+                received.append(data)
+                respond(conn)
+        
+        def accept():
+            while True:
+                try:
+                    conn, _ = server.accept()
+                except OSError:
+                    return
+                threading.Thread(target=handle, args=(conn,), daemon=True).start()
+        
+        threading.Thread(target=accept, daemon=True).start()
+        self.addCleanup(server.close)
+        return f'http://127.0.0.1:{server.getsockname()[1]}', received
+    
+    def test_client_retries(self):
+        """Test that only a stale kept-alive connection is retried"""
+        import socket
+        import time
+        
+        # Answers as if keeping the connection alive, then closes it
+        url, received = self.serve_raw(
+            lambda conn: conn.sendall(b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok'))
+        client = self.loadtest.Client(url, timeout=5)
+        self.assertEqual(client.request('GET', '/'), (200, b'ok'))
+        time.sleep(0.1)
+        self.assertEqual(client.request('GET', '/'), (200, b'ok'))
+        client.close()
+        self.assertEqual(len(received), 2)
+        
+        # A slow request is sent once and fails, rather than being sent again
+        url, received = self.serve_raw(lambda conn: time.sleep(1))
+        client = self.loadtest.Client(url, timeout=0.2)
+        with self.assertRaises(socket.timeout):
+            client.request('GET', '/')
+        time.sleep(0.1)
+        self.assertEqual(len(received), 1)
+    
+    def test_empty_report(self):
+        """Test that a run without requests can be reported"""
+        import contextlib
+        import io
+        report = {'seed': 1, 'concurrency': 1, 'elapsed_seconds': 0.0, 'server_rss': None,
+                  **self.loadtest.summarize([], elapsed=0.0)}
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            self.loadtest.print_report(report)
+        self.assertIn('overall', output.getvalue())
+
+
+class TestUploadHandler(unittest.TestCase):
+    """Test cases for early upload validation"""
+    
+    def test_detect_image_type(self):
+        """Test that every supported format is recognised from its first bytes"""
+        for fmt, expected in [('PNG', 'png'), ('JPEG', 'jpeg'), ('GIF', 'gif'),
+                              ('BMP', 'bmp'), ('WEBP', 'webp'), ('TIFF', 'tiff')]:
+            buffer = BytesIO()
+            Image.new('RGB', (8, 8), color='red').save(buffer, format=fmt)
+            head = buffer.getvalue()[:UploadHandler.SNIFF_SIZE]
+            self.assertEqual(UploadHandler.detect_image_type(head), expected)
+        
+        self.assertIsNone(UploadHandler.detect_image_type(b'%PDF-1.7'))
+        self.assertIsNone(UploadHandler.detect_image_type(b'RIFF\x00\x00\x00\x00WAVE'))
+        self.assertIsNone(UploadHandler.detect_image_type(b''))
+    
+    def test_stream_upload_save(self):
+        """Test that a raw upload is saved with its sniffed head put back"""
+        import os
+        import tempfile
+        
+        class ShortReads(BytesIO):
+            def read(self, size=-1):
+                return super().read(min(size, 3) if size and size > 0 else size)
+        
+        body = b'\x89PNG\r\n\x1a\n' + os.urandom(10000)
+        stream = ShortReads(body)
+        head = UploadHandler.read_head(stream, 16)
+        self.assertEqual(head, body[:16])
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'upload.png')
+            StreamUpload('upload.png', head, stream, chunk_size=1000).save(path)
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), body)
+    
+    def test_deferred_100_continue(self):
+        """Test that 100 Continue is only sent once the body is read"""
+        import socket
+        import threading
+        from werkzeug.serving import make_server
+        
+        def wsgi_app(environ, start_response):
+            if environ['PATH_INFO'] == '/reject':
+                body = b'rejected'
+            else:
+                body = environ['wsgi.input'].read(int(environ['CONTENT_LENGTH']))
+            start_response('200 OK', [('Content-Length', str(len(body)))])
+            return [body]
+        
+        server = make_server('127.0.0.1', 0, wsgi_app, threaded=True,
+                             request_handler=ExpectContinueRequestHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            def send_headers(path):
+                sock = socket.create_connection(server.server_address, timeout=5)
+                sock.sendall((f'POST {path} HTTP/1.1\r\nHost: localhost\r\n'
+                              'Content-Length: 5\r\nExpect: 100-continue\r\n\r\n').encode())
+                return sock
+            
+            # Rejected from headers alone: the final response comes first
+            sock = send_headers('/reject')
+            with sock:
+                self.assertTrue(sock.recv(1024).startswith(b'HTTP/1.1 200'))
+            
+            # Body wanted: the client is told to continue, then gets the echo
+            sock = send_headers('/echo')
+            with sock:
+                self.assertEqual(sock.recv(1024), b'HTTP/1.1 100 Continue\r\n\r\n')
+                sock.sendall(b'hello')
+                response = b''
+                while not response.endswith(b'hello'):
+                    chunk = sock.recv(1024)
+                    if not chunk:
+                        break
+                    response += chunk
+                self.assertTrue(response.startswith(b'HTTP/1.1 200'))
+                self.assertTrue(response.endswith(b'hello'))
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+class TestApp(unittest.TestCase):
+    """Test cases for the Flask app built by create_app"""
+    
+    def setUp(self):
+        import tempfile
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp_dir.name)
+        self.app = create_app({
+            'TESTING': True,
+            'UPLOAD_FOLDER': str(self.root / 'uploads'),
+            'ENCRYPTED_FOLDER': str(self.root / 'encrypted'),
+            'CATALOG_DB': str(self.root / 'catalog.db'),
+            'STORAGE_BACKEND': 'local',
+            'JOBS_DB': None,
+            'RETENTION_ENABLED': False,
+            'MAX_FILE_SIZE': 1024 * 1024
+        })
+        self.client = self.app.test_client()
+        self.key = CryptoHandler.generate_key()
+        
+        buffer = BytesIO()
+        Image.new('RGB', (16, 16), color='blue').save(buffer, format='PNG')
+        self.image = buffer.getvalue()
+    
+    def tearDown(self):
+        self.app.extensions['pixellock'].close()
+        self.tmp_dir.cleanup()
+    
+    def encrypt(self, data, key=None, filename='photo.png'):
+        return self.client.post('/api/encrypt', data=data, headers={
+            'Content-Type': 'image/png',
+            'X-Encryption-Key': key or self.key,
+            'X-Filename': filename
+        })
+    
+    def test_create_app_is_lazy(self):
+        """Test that creating an app touches nothing until a request needs it"""
+        import threading
+        threads = threading.active_count()
+        app = create_app({'UPLOAD_FOLDER': str(self.root / 'lazy'),
+                          'CATALOG_DB': str(self.root / 'lazy.db')})
+        self.assertEqual(list(self.root.iterdir()), [])
+        self.assertEqual(threading.active_count(), threads)
+        self.assertEqual(app.config['JOB_FOLDER'], str(self.root / 'lazy' / 'jobs'))
+        self.assertEqual(app.config['MAX_CONTENT_LENGTH'], app.config['MAX_FILE_SIZE'])
+        
+        # A forked worker drops the services it inherited and builds its own
+        services = app.extensions['pixellock']
+        catalog = services.catalog
+        self.assertIs(services.catalog, catalog)
+        services._pid = -1
+        self.assertIsNot(services.catalog, catalog)
+    
+    def test_apps_are_isolated(self):
+        """Test that two apps never share storage or catalog"""
+        self.assertEqual(self.encrypt(self.image).status_code, 200)
+        
+        other = create_app({'UPLOAD_FOLDER': str(self.root / 'other'),
+                            'ENCRYPTED_FOLDER': str(self.root / 'other-enc'),
+                            'CATALOG_DB': str(self.root / 'other.db'),
+                            'RETENTION_ENABLED': False})
+        self.assertEqual(other.test_client().get('/api/files').get_json()['files'], [])
+        self.assertEqual(len(self.client.get('/api/files').get_json()['files']), 1)
+        other.extensions['pixellock'].close()
+    
+    def test_encrypt_and_fetch(self):
+        """Test a raw-body encryption and downloading its ciphertext"""
+        import base64
+        response = self.encrypt(self.image)
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()
+        self.assertEqual(data['file_size'], len(self.image))
+        self.assertEqual(data['original_hash'], HashHandler.generate_hash_from_data(self.image)['hash'])
+        self.assertFalse((self.root / 'uploads' / 'photo.png').exists())
+        
+        content = self.client.get(f"/api/files/{data['file_id']}/content")
+        decrypted = CryptoHandler.decrypt_image(base64.b64encode(content.data).decode(), self.key)
+        self.assertEqual(base64.b64decode(decrypted['decrypted_data']), self.image)
+        
+        url = f"/api/files/{data['file_id']}/content"
+        total = len(content.data)
+        partial = self.client.get(url, headers={'Range': 'bytes=8-15'})
+        self.assertEqual(partial.status_code, 206)
+        self.assertEqual(partial.data, content.data[8:16])
+        self.assertEqual(partial.headers['Content-Range'], f'bytes 8-15/{total}')
+        
+        unsatisfiable = self.client.get(url, headers={'Range': f'bytes={total}-'})
+        self.assertEqual(unsatisfiable.status_code, 416)
+        self.assertEqual(unsatisfiable.headers['Content-Range'], f'bytes */{total}')
+    
+    def submit_job(self):
+        response = self.client.post('/api/jobs/encrypt', data=self.image, headers={
+            'Content-Type': 'image/png',
+            'X-Encryption-Key': self.key,
+            'X-Filename': 'photo.png'
+        })
+        self.assertEqual(response.status_code, 202)
+        return response.get_json()
+    
+    def wait_for_job(self, job, timeout=10):
+        import time
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            status = self.client.get(job['status_url']).get_json()
+            if status['state'] in ('completed', 'failed'):
+                return status
+            time.sleep(0.02)
+        self.fail('Job did not finish in time')
+    
+    def test_encrypt_job(self):
+        """Test a background encryption job from submission to its stored ciphertext"""
+        import base64
+        job = self.submit_job()
+        status = self.wait_for_job(job)
+        self.assertEqual(status['state'], 'completed')
+        self.assertEqual(status['bytes_processed'], len(self.image))
+        
+        result = self.client.get(job['result_url'])
+        self.assertEqual(result.status_code, 200)
+        data = result.get_json()
+        self.assertEqual(data['original_hash'], HashHandler.generate_hash_from_data(self.image)['hash'])
+        self.assertEqual(data['file_size'], len(self.image))
+        self.assertIsNotNone(data['tree_root'])
+        
+        content = self.client.get(f"/api/files/{data['file_id']}/content")
+        self.assertEqual(len(content.data), data['encrypted_size'])
+        decrypted = CryptoHandler.decrypt_image(base64.b64encode(content.data).decode(), self.key)
+        self.assertEqual(base64.b64decode(decrypted['decrypted_data']), self.image)
+        self.assertEqual(self.client.get(f"/api/files/{data['file_id']}/tree").status_code, 200)
+        self.assertEqual(list((self.root / 'uploads' / 'jobs').iterdir()), [])
+    
+    def test_failed_encrypt_job(self):
+        """Test that a failed job reports 400 and removes its upload"""
+        from unittest import mock
+        from app.storage_handler import LocalStorage
+        with mock.patch.object(LocalStorage, 'write', side_effect=StorageError('disk full')):
+            job = self.submit_job()
+            status = self.wait_for_job(job)
+        self.assertEqual(status['state'], 'failed')
+        self.assertIn('disk full', status['error'])
+        
+        result = self.client.get(job['result_url'])
+        self.assertEqual(result.status_code, 400)
+        self.assertFalse(result.get_json()['success'])
+        self.assertEqual(list((self.root / 'uploads' / 'jobs').iterdir()), [])
+        self.assertEqual(self.client.get('/api/jobs/unknown').status_code, 404)
+    
+    def test_early_rejection(self):
+        """Test that bad keys, names, sizes and contents are refused"""
+        self.assertEqual(self.encrypt(self.image, key='bad').status_code, 400)
+        self.assertEqual(self.encrypt(self.image, filename='photo.exe').status_code, 400)
+        self.assertEqual(self.encrypt(b'%PDF-1.7 not an image').status_code, 415)
+        self.assertEqual(self.encrypt(self.image * 100000).status_code, 413)
+        self.assertEqual(self.client.post('/api/encrypt', data=self.image).status_code, 400)
+        self.assertFalse((self.root / 'encrypted').exists() and any((self.root / 'encrypted').iterdir()))
 
 
 class TestIntegration(unittest.TestCase):